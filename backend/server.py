@@ -1,20 +1,36 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, UploadFile, File, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument, monitoring
+from pymongo.errors import DuplicateKeyError
+from gridfs.errors import NoFile
 import os
 import logging
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from urllib.parse import parse_qs
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
 import jwt
 from passlib.context import CryptContext
 import base64
+import csv
+import io
 import json
+import re
+import zipfile
 from io import BytesIO
+from xml.sax.saxutils import escape as xml_escape
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib import colors
 from reportlab.lib.units import inch
@@ -24,14 +40,64 @@ from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
 from fastapi.responses import StreamingResponse
 import gspread
 from google.oauth2.service_account import Credentials
+from pyinstrument import Profiler
+from pyinstrument.renderers import SpeedscopeRenderer
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Mongo command timings of the request being profiled, None for every other request.
+# Motor copies the context into its executor threads, so the listener sees it.
+profiled_mongo_calls: ContextVar[Optional[dict]] = ContextVar("profiled_mongo_calls", default=None)
+
+# Off by default: with a listener registered pymongo builds start/finish events for every command of
+# every request, profiled or not (~4us per command including the listener's ContextVar check).
+# Turn on while investigating to get Mongo timings in profiles; without it they carry none.
+PROFILE_MONGO_CALLS = os.environ.get("PROFILE_MONGO_CALLS", "false").lower() == "true"
+# Individual calls kept per profile; totals always cover every call
+PROFILE_MAX_MONGO_CALLS = 2000
+
+class MongoProfilingListener(monitoring.CommandListener):
+    """Record command timings, but only while a profiled request is running"""
+
+    def started(self, event):
+        recording = profiled_mongo_calls.get()
+        if recording is None:
+            return
+        collection = event.command.get(event.command_name)
+        recording["pending"][event.request_id] = (
+            event.command_name,
+            collection if isinstance(collection, str) else None
+        )
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "failed")
+
+    def _finish(self, event, outcome):
+        recording = profiled_mongo_calls.get()
+        if recording is None:
+            return
+        command, collection = recording["pending"].pop(event.request_id, (event.command_name, None))
+        recording["count"] += 1
+        recording["total_ms"] += event.duration_micros / 1000
+        if len(recording["calls"]) >= PROFILE_MAX_MONGO_CALLS:
+            return
+        recording["calls"].append({
+            "command": command,
+            "collection": collection,
+            "duration_ms": event.duration_micros / 1000,
+            "outcome": outcome
+        })
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoProfilingListener()] if PROFILE_MONGO_CALLS else [])
 db = client[os.environ['DB_NAME']]
+# Flamegraphs of long requests can pass the 16MB document limit
+profile_files = AsyncIOMotorGridFSBucket(db, bucket_name="profile_flamegraphs")
 
 # Security
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -44,6 +110,85 @@ GOOGLE_SHEETS_ENABLED = os.environ.get("GOOGLE_SHEETS_ENABLED", "false").lower()
 GOOGLE_SHEET_ID = os.environ.get("GOOGLE_SHEET_ID", "")
 GOOGLE_SERVICE_ACCOUNT_JSON = os.environ.get("GOOGLE_SERVICE_ACCOUNT_JSON", "")
 
+# Rate Limiting Configuration
+# "mongo" shares buckets and concurrency slots across uvicorn workers, "memory" is per-process (tests/dev)
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "mongo").lower()
+# IMPORTANT: number of reverse proxies in front of the app that append to X-Forwarded-For.
+# The default of 1 matches the ingress we deploy behind; the client IP is the entry that proxy appended.
+# Set to 0 when uvicorn is exposed directly, otherwise clients can pick their own IP by sending the header.
+# Getting this wrong in the other direction puts every client in the proxy's IP bucket, so the whole
+# workshop shares one login/invoice/export allowance.
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "1"))
+
+# scope -> (bucket capacity, tokens refilled per second)
+RATE_LIMITS = {
+    # Every login attempt from one IP (a workshop usually shares one)
+    "login": (20, 20 / 60),
+    # Wrong passwords per (username, IP), so a stranger cannot lock the account out for everyone
+    "login_failures": (5, 5 / 60),
+    "invoice": (10, 10 / 60),
+    "export": (3, 3 / 60),
+}
+
+# scope -> (max concurrent requests across all workers, Retry-After seconds when full)
+CONCURRENCY_LIMITS = {
+    "login": (8, 1),
+    "invoice": (4, 2),
+    "export": (1, 10),
+}
+
+# Slots are leased so a crashed worker cannot hold them forever
+CONCURRENCY_LEASE_SECONDS = 120
+
+# Branch Configuration
+# Every user and job belongs to one branch (workshop); records created before branches existed belong to the default.
+# The default branch is the head office: only its managers can open new branches
+DEFAULT_BRANCH = os.environ.get("DEFAULT_BRANCH", "chennai")
+# Job dates (entry_date, estimated_delivery) are the workshop's local calendar dates
+WORKSHOP_TIMEZONE = ZoneInfo(os.environ.get("WORKSHOP_TIMEZONE", "Asia/Kolkata"))
+# Branch ids end up in worksheet titles and cache keys
+BRANCH_ID_PATTERN = re.compile(r"^[a-z0-9][a-z0-9-]{0,31}$")
+
+# Invoice identity used by branches that have not configured their own
+DEFAULT_BRANCH_PROFILE = {
+    "name": "ICD Tuning",
+    "tagline": "Performance Tuning | ECU Remaps | Custom Builds",
+    "address": "Chennai, Tamil Nadu",
+    "phone": "+91 98765 43210",
+    "email": "icdtuning@gmail.com",
+    "invoice_prefix": "ICD",
+}
+
+# Request Profiling Configuration
+# Managers opt a single request in with the X-Profile: 1 header or ?profile=1
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY_FLAG = b"profile="
+PROFILE_SAMPLE_INTERVAL = 0.001
+PROFILE_RETENTION_DAYS = 7
+
+# Read-through Cache Configuration
+# Values live in a per-process LRU. The backend holds what workers must agree on: a small version token
+# per key (bumped on invalidation) and hit/miss counters. "mongo" shares them across uvicorn workers,
+# "memory" keeps them per process (tests/dev)
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "mongo").lower()
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "128"))
+# Job entries include their base64 photos (several MB each), so the LRU is also bounded by size
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# A confirmed entry is served without asking the backend for its version for this long.
+# Invalidations from the same worker apply at once, other workers see them within this window
+CACHE_VERSION_CHECK_SECONDS = float(os.environ.get("CACHE_VERSION_CHECK_SECONDS", "2"))
+# How often each worker adds its hit/miss counts to the shared totals
+CACHE_STATS_FLUSH_SECONDS = 5
+# Must outlive every TTL below, so a forgotten version can no longer match a cached value
+CACHE_VERSION_RETENTION_SECONDS = 24 * 3600
+
+# namespace -> time to live in seconds
+CACHE_TTLS = {
+    "mechanics": 300,
+    "job": 60,
+    "branch": 300,
+}
+
 def get_google_sheets_client():
     """Initialize Google Sheets client"""
     if not GOOGLE_SHEETS_ENABLED or not GOOGLE_SERVICE_ACCOUNT_JSON:
@@ -83,6 +228,7 @@ class User(BaseModel):
     username: str
     role: str  # "Manager" or "Mechanic"
     full_name: str
+    branch: str = DEFAULT_BRANCH
 
 class UserCreate(BaseModel):
     username: str
@@ -120,6 +266,8 @@ class Job(BaseModel):
     notes: Optional[str] = None
     completion_date: Optional[str] = None
     confirm_complete: bool = False
+    branch: str = DEFAULT_BRANCH
+    version: int = 0  # bumped on every update, orders writes to derived collections
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 class JobCreate(BaseModel):
@@ -161,10 +309,76 @@ class StatusUpdate(BaseModel):
 class NoteAdd(BaseModel):
     note: str
 
+class JobEvent(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    job_id: str
+    type: str  # created, status, note, photo
+    actor: str
+    ts: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    message: Optional[str] = None
+    from_status: Optional[str] = None
+    to_status: Optional[str] = None
+
+class JobEventPage(BaseModel):
+    events: List[JobEvent]
+    # Pass as `before_ts`/`before_id` to fetch the next (older) page
+    next_before_ts: Optional[str] = None
+    next_before_id: Optional[str] = None
+
+class QueueEntry(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    job_id: str
+    customer_name: str
+    contact_number: str
+    car_brand: str
+    car_model: str
+    year: int
+    registration_number: str
+    entry_date: str
+    estimated_delivery: str
+    status: str
+    work_description: str
+    overdue: bool = False
+
+class MechanicQueue(BaseModel):
+    mechanic: str
+    total: int
+    overdue_count: int
+    page: int
+    page_size: int
+    items: List[QueueEntry]
+
+class CompletedJobs(BaseModel):
+    mechanic: str
+    total: int
+    page: int
+    page_size: int
+    items: List[Job]  # without photos
+
 class WhatsAppRequest(BaseModel):
     job_id: str
     message: str
 
+class BranchProfile(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    name: str
+    tagline: str = ""
+    address: str = ""
+    phone: str = ""
+    email: str = ""
+    invoice_prefix: str
+
+class BranchCreate(BaseModel):
+    branch: str
+    profile: BranchProfile
+    manager: UserCreate  # the branch's first manager, role is always "Manager"
+
+class BranchCreated(BaseModel):
+    branch: str
+    profile: BranchProfile
+    manager: User
+
 class InvoiceData(BaseModel):
     labour_cost: float = 0
     parts_cost: float = 0
@@ -206,17 +420,493 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     user = await db.users.find_one({"username": username}, {"_id": 0, "password_hash": 0})
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
-    return User(**user)
+    user = User(**user)
+    
+    # Tokens issued before branches existed carry no branch claim
+    if payload.get("branch", user.branch) != user.branch:
+        raise HTTPException(status_code=401, detail="Branch changed, please log in again")
+    return user
 
 def require_manager(current_user: User = Depends(get_current_user)):
     if current_user.role != "Manager":
         raise HTTPException(status_code=403, detail="Manager access required")
     return current_user
 
+def branch_query(current_user: User, **filters) -> dict:
+    """Query filter limited to the user's branch. Every jobs/users query goes through this"""
+    return {"branch": current_user.branch, **filters}
+
+async def ensure_branch_mechanic(current_user: User, username: str):
+    """Jobs can only be assigned to a mechanic of the manager's own branch"""
+    mechanic = await db.users.find_one(branch_query(current_user, username=username, role="Mechanic"), {"_id": 1})
+    if not mechanic:
+        raise HTTPException(status_code=400, detail="Assigned mechanic not found in this branch")
+
+async def record_job_event(job_id: str, event_type: str, actor: str, **fields) -> JobEvent:
+    """Append to the job's activity log. Never touches the job document itself"""
+    event = JobEvent(job_id=job_id, type=event_type, actor=actor, **fields)
+    await db.job_events.insert_one(event.model_dump())
+    return event
+
+# Jobs in these statuses are on their mechanic's work queue
+QUEUE_STATUSES = ["Pending", "In Progress"]
+
+# Copied from the job into its queue entry, enough to render the queue without loading jobs
+QUEUE_FIELDS = [
+    "customer_name", "contact_number", "car_brand", "car_model", "year",
+    "registration_number", "entry_date", "estimated_delivery", "status", "work_description"
+]
+
+# Removed entries stay behind this long so a late write from an older snapshot cannot re-add them
+QUEUE_TOMBSTONE_SECONDS = 3600
+
+async def sync_mechanic_queue(job: dict):
+    """Bring the job's entry in db.mechanic_queue in line with the job. Call after every job write
+    with the document the write returned; an entry is only replaced by a newer job version"""
+    version = job.get("version", 0)
+    if job.get("status") not in QUEUE_STATUSES:
+        # No branch or mechanic, so queue queries never match it
+        entry = {"job_id": job["id"], "version": version, "removed_at": datetime.now(timezone.utc)}
+    else:
+        entry = {
+            "job_id": job["id"],
+            "branch": job.get("branch", DEFAULT_BRANCH),
+            "mechanic": job["assigned_mechanic"],
+            "version": version,
+            **{field: job.get(field) for field in QUEUE_FIELDS}
+        }
+    
+    older = {"$or": [{"version": {"$lt": version}}, {"version": {"$exists": False}}]}
+    try:
+        await db.mechanic_queue.replace_one({"job_id": job["id"], **older}, entry, upsert=True)
+    except DuplicateKeyError:
+        pass  # the stored entry is from this version or a newer one
+
+# ===== RATE LIMITING =====
+
+class InMemoryRateLimitBackend:
+    """Per-process token buckets and concurrency slots, used for tests and single-worker dev"""
+
+    MAX_BUCKETS = 10000
+
+    def __init__(self):
+        self.buckets = {}  # key -> (tokens, updated, full_at)
+        self.slots = {}  # key -> {token: lease expiry}
+
+    async def setup(self):
+        pass
+
+    async def take_token(self, key: str, capacity: float, refill_rate: float, cost: int = 1) -> float:
+        """Take `cost` tokens (0 only checks) if one is available.
+        Returns 0 when allowed, otherwise seconds until a token is available"""
+        now = time.monotonic()
+        if len(self.buckets) > self.MAX_BUCKETS:
+            # Buckets that have refilled completely carry no state worth keeping
+            self.buckets = {k: bucket for k, bucket in self.buckets.items() if bucket[2] > now}
+        tokens, updated, _ = self.buckets.get(key, (capacity, now, now))
+        tokens = min(capacity, tokens + (now - updated) * refill_rate)
+        if tokens >= 1:
+            tokens -= cost
+            retry_after = 0
+        else:
+            retry_after = (1 - tokens) / refill_rate
+        self.buckets[key] = (tokens, now, now + (capacity - tokens) / refill_rate)
+        return retry_after
+
+    async def acquire_slot(self, key: str, limit: int, lease_seconds: float) -> Optional[str]:
+        """Lease one of `limit` slots. Returns a release token, or None when all slots are taken"""
+        now = time.monotonic()
+        holders = {token: expiry for token, expiry in self.slots.get(key, {}).items() if expiry > now}
+        self.slots[key] = holders
+        if len(holders) >= limit:
+            return None
+        token = str(uuid.uuid4())
+        holders[token] = now + lease_seconds
+        return token
+
+    async def renew_slot(self, key: str, token: str, lease_seconds: float):
+        holders = self.slots.get(key, {})
+        if token in holders:
+            holders[token] = time.monotonic() + lease_seconds
+
+    async def release_slot(self, key: str, token: str):
+        self.slots.get(key, {}).pop(token, None)
+
+class MongoRateLimitBackend:
+    """Token buckets and concurrency slots stored in MongoDB so limits hold across uvicorn workers"""
+
+    def __init__(self, database):
+        self.buckets = database.rate_limits
+        self.slots = database.concurrency_slots
+
+    async def setup(self):
+        # Idle buckets and abandoned slot documents are removed by MongoDB
+        await self.buckets.create_index("expires_at", expireAfterSeconds=0)
+        await self.slots.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take_token(self, key: str, capacity: float, refill_rate: float, cost: int = 1) -> float:
+        """Take `cost` tokens (0 only checks) if one is available.
+        Returns 0 when allowed, otherwise seconds until a token is available"""
+        now = time.time()
+        # A bucket left alone this long is full again, which is the same as not existing
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=capacity / refill_rate)
+        refilled = {"$min": [capacity, {"$add": [
+            {"$ifNull": ["$tokens", capacity]},
+            {"$multiply": [{"$subtract": [now, {"$ifNull": ["$updated", now]}]}, refill_rate]},
+        ]}]}
+        has_token = {"$gte": ["$tokens", 1]}
+        pipeline = [
+            {"$set": {"tokens": refilled, "updated": now, "expires_at": expires_at}},
+            {"$set": {
+                "allowed": has_token,
+                "tokens": {"$cond": [has_token, {"$subtract": ["$tokens", cost]}, "$tokens"]},
+            }},
+        ]
+        try:
+            bucket = await self.buckets.find_one_and_update(
+                {"_id": key}, pipeline, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Another worker created the bucket at the same moment; it exists now
+            bucket = await self.buckets.find_one_and_update(
+                {"_id": key}, pipeline, return_document=ReturnDocument.AFTER
+            )
+        if bucket["allowed"]:
+            return 0
+        return (1 - bucket["tokens"]) / refill_rate
+
+    async def acquire_slot(self, key: str, limit: int, lease_seconds: float) -> Optional[str]:
+        """Lease one of `limit` slots. Returns a release token, or None when all slots are taken"""
+        now = datetime.now(timezone.utc)
+        lease_expiry = now + timedelta(seconds=lease_seconds)
+        token = str(uuid.uuid4())
+        await self.slots.update_one({"_id": key}, {"$pull": {"holders": {"expires_at": {"$lte": now}}}})
+        try:
+            # Only matches while fewer than `limit` holders exist; a full document makes the
+            # upsert collide on _id instead, which means no slot is free
+            await self.slots.update_one(
+                {"_id": key, f"holders.{limit - 1}": {"$exists": False}},
+                {
+                    "$push": {"holders": {"token": token, "expires_at": lease_expiry}},
+                    "$max": {"expires_at": lease_expiry},
+                },
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return None
+        return token
+
+    async def renew_slot(self, key: str, token: str, lease_seconds: float):
+        lease_expiry = datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)
+        await self.slots.update_one(
+            {"_id": key, "holders.token": token},
+            {"$set": {"holders.$.expires_at": lease_expiry}, "$max": {"expires_at": lease_expiry}}
+        )
+
+    async def release_slot(self, key: str, token: str):
+        await self.slots.update_one({"_id": key}, {"$pull": {"holders": {"token": token}}})
+
+def get_rate_limit_backend():
+    if RATE_LIMIT_BACKEND == "memory":
+        return InMemoryRateLimitBackend()
+    return MongoRateLimitBackend(db)
+
+rate_limiter = get_rate_limit_backend()
+
+def get_client_ip(request: Request) -> str:
+    """Client address as seen by the outermost trusted proxy (see TRUSTED_PROXY_HOPS)"""
+    forwarded_for = request.headers.get("x-forwarded-for")
+    if TRUSTED_PROXY_HOPS > 0 and forwarded_for:
+        # Entries left of the ones our proxies appended were written by the client and can be forged
+        hops = [hop.strip() for hop in forwarded_for.split(",")]
+        return hops[max(0, len(hops) - TRUSTED_PROXY_HOPS)]
+    return request.client.host if request.client else "unknown"
+
+def too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many requests, please try again later",
+        headers={"Retry-After": str(math.ceil(retry_after))}
+    )
+
+async def enforce_rate_limit(request: Request, scope: str, username: Optional[str] = None):
+    """Charge one token to the caller's IP bucket (and user bucket if known), 429 when either is empty"""
+    capacity, refill_rate = RATE_LIMITS[scope]
+    keys = [f"{scope}:ip:{get_client_ip(request)}"]
+    if username:
+        keys.append(f"{scope}:user:{username}")
+    
+    retry_after = 0
+    for key in keys:
+        retry_after = max(retry_after, await rate_limiter.take_token(key, capacity, refill_rate))
+    
+    if retry_after > 0:
+        raise too_many_requests(retry_after)
+
+async def enforce_login_failure_limit(request: Request, username: str, failed: bool = False):
+    """Limit wrong passwords per (username, IP).
+
+    Call before checking the password to reject a locked-out pair without spending a token,
+    and with failed=True after a wrong password to charge one.
+    """
+    capacity, refill_rate = RATE_LIMITS["login_failures"]
+    key = f"login_failures:{username}:{get_client_ip(request)}"
+    retry_after = await rate_limiter.take_token(key, capacity, refill_rate, cost=1 if failed else 0)
+    if retry_after > 0 and not failed:
+        raise too_many_requests(retry_after)
+
+async def acquire_concurrency_slot(scope: str) -> str:
+    """Lease one of the scope's shared slots, 503 when all are busy. Release with rate_limiter.release_slot"""
+    limit, retry_after = CONCURRENCY_LIMITS[scope]
+    token = await rate_limiter.acquire_slot(scope, limit, CONCURRENCY_LEASE_SECONDS)
+    if token is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please try again shortly",
+            headers={"Retry-After": str(retry_after)}
+        )
+    return token
+
+@asynccontextmanager
+async def concurrency_limit(scope: str):
+    """Hold one of the scope's shared slots while the block runs, 503 when all are busy"""
+    token = await acquire_concurrency_slot(scope)
+    try:
+        yield
+    finally:
+        await rate_limiter.release_slot(scope, token)
+
+async def release_slot_after(stream, scope: str, token: str):
+    """Pass `stream` through and release the concurrency slot once it finishes or is abandoned.
+
+    The lease is renewed while the stream runs. A stream that is never started keeps its slot until it expires.
+    """
+    renewed_at = time.monotonic()
+    try:
+        async for chunk in stream:
+            yield chunk
+            if time.monotonic() - renewed_at > CONCURRENCY_LEASE_SECONDS / 2:
+                await rate_limiter.renew_slot(scope, token, CONCURRENCY_LEASE_SECONDS)
+                renewed_at = time.monotonic()
+    finally:
+        await rate_limiter.release_slot(scope, token)
+
+# ===== CACHING =====
+
+def approximate_size(value) -> int:
+    """Rough in-memory footprint of a loaded document: string lengths plus a fixed cost per object"""
+    if isinstance(value, (str, bytes)):
+        return 50 + len(value)
+    if isinstance(value, dict):
+        return 64 + sum(approximate_size(k) + approximate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(approximate_size(item) for item in value)
+    return 32
+
+class LocalLRUCache:
+    """Per-process LRU with per-entry expiry, holding the cached values themselves"""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()  # key -> [expiry, version, checked_at, size, value]
+
+    def get(self, key: str) -> Optional[list]:
+        """[expiry, version, checked_at, size, value] of a live entry, or None"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self.delete(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, version: Optional[str], value, ttl: float):
+        self.delete(key)
+        size = approximate_size(value)
+        if size > self.max_bytes:
+            return
+        # checked_at 0: the version read before the load is confirmed again on the next read
+        self.entries[key] = [time.monotonic() + ttl, version, 0.0, size, value]
+        self.total_bytes += size
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= evicted[3]
+
+    def delete(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[3]
+
+class InMemoryCacheBackend:
+    """Per-process versions and counters, used for tests and single-worker dev"""
+
+    def __init__(self):
+        self.versions = {}  # key -> version token
+        self.stats = {}  # namespace -> {"hits": n, "misses": n}
+
+    async def setup(self):
+        pass
+
+    async def get_version(self, key: str) -> Optional[str]:
+        return self.versions.get(key)
+
+    async def bump_version(self, key: str):
+        self.versions[key] = str(uuid.uuid4())
+
+    async def add_stats(self, counts: dict):
+        for namespace, outcomes in counts.items():
+            totals = self.stats.setdefault(namespace, {"hits": 0, "misses": 0})
+            for outcome, count in outcomes.items():
+                totals[outcome] += count
+
+    async def get_stats(self) -> dict:
+        return {namespace: dict(totals) for namespace, totals in self.stats.items()}
+
+class MongoCacheBackend:
+    """Versions and counters stored in MongoDB so every worker sees the same invalidations and totals"""
+
+    def __init__(self, database):
+        self.versions = database.cache_versions
+        self.stats = database.cache_stats
+
+    async def setup(self):
+        await self.versions.create_index("expires_at", expireAfterSeconds=0)
+
+    async def get_version(self, key: str) -> Optional[str]:
+        entry = await self.versions.find_one({"_id": key}, {"version": 1})
+        return entry["version"] if entry else None
+
+    async def bump_version(self, key: str):
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=CACHE_VERSION_RETENTION_SECONDS)
+        await self.versions.replace_one(
+            {"_id": key}, {"version": str(uuid.uuid4()), "expires_at": expires_at}, upsert=True
+        )
+
+    async def add_stats(self, counts: dict):
+        for namespace, outcomes in counts.items():
+            await self.stats.update_one({"_id": namespace}, {"$inc": outcomes}, upsert=True)
+
+    async def get_stats(self) -> dict:
+        return {
+            entry["_id"]: {"hits": entry.get("hits", 0), "misses": entry.get("misses", 0)}
+            async for entry in self.stats.find()
+        }
+
+class ReadThroughCache:
+    """Serve values from the local LRU while their version matches the shared one, loading them on a miss"""
+
+    def __init__(self, backend, max_entries: int, max_bytes: int = CACHE_MAX_BYTES):
+        self.backend = backend
+        self.local = LocalLRUCache(max_entries, max_bytes)
+        self.pending_stats = {}  # namespace -> {"hits": n, "misses": n} not yet added to the backend
+        self.last_flush = time.monotonic()
+
+    async def get_or_load(self, namespace: str, key: str, loader):
+        """Return the cached value or `await loader()`. None results are not cached"""
+        full_key = f"{namespace}:{key}"
+        entry = self.local.get(full_key)
+        if entry is not None and time.monotonic() - entry[2] < CACHE_VERSION_CHECK_SECONDS:
+            await self.count(namespace, "hits")
+            return entry[4]
+        
+        # Read the version before loading: an invalidation during the load then leaves the stored entry stale
+        version = await self.backend.get_version(full_key)
+        if entry is not None and entry[1] == version:
+            entry[2] = time.monotonic()
+            await self.count(namespace, "hits")
+            return entry[4]
+        
+        await self.count(namespace, "misses")
+        value = await loader()
+        if value is not None:
+            self.local.set(full_key, version, value, CACHE_TTLS[namespace])
+        return value
+
+    async def invalidate(self, namespace: str, key: str):
+        self.local.delete(f"{namespace}:{key}")
+        await self.backend.bump_version(f"{namespace}:{key}")
+
+    async def count(self, namespace: str, outcome: str):
+        counts = self.pending_stats.setdefault(namespace, {"hits": 0, "misses": 0})
+        counts[outcome] += 1
+        if time.monotonic() - self.last_flush >= CACHE_STATS_FLUSH_SECONDS:
+            await self.flush_stats()
+
+    async def flush_stats(self):
+        pending, self.pending_stats = self.pending_stats, {}
+        self.last_flush = time.monotonic()
+        if pending:
+            await self.backend.add_stats(pending)
+
+    async def get_stats(self) -> dict:
+        """Totals across all workers, each lagging by at most CACHE_STATS_FLUSH_SECONDS"""
+        await self.flush_stats()
+        totals = await self.backend.get_stats()
+        return {
+            namespace: {
+                "hits": counts["hits"],
+                "misses": counts["misses"],
+                "hit_rate": round(counts["hits"] / (counts["hits"] + counts["misses"]), 4)
+                if counts["hits"] + counts["misses"] else 0.0
+            }
+            for namespace, counts in totals.items()
+        }
+
+def get_cache_backend():
+    if CACHE_BACKEND == "memory":
+        return InMemoryCacheBackend()
+    return MongoCacheBackend(db)
+
+cache = ReadThroughCache(get_cache_backend(), CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+
+# ===== EXPORT COLUMNS =====
+
+# Shared by the Google Sheets export and the CSV/XLSX downloads
+EXPORT_HEADERS = [
+    "Job ID",
+    "Customer Name",
+    "Contact Number",
+    "Vehicle",
+    "Registration No",
+    "VIN",
+    "Odometer (KMs)",
+    "Entry Date",
+    "Assigned Mechanic",
+    "Work Description",
+    "Estimated Delivery",
+    "Status",
+    "Invoice Amount",
+    "Notes",
+    "Completion Date",
+    "Created At"
+]
+
+def job_export_row(job: dict) -> list:
+    return [
+        job.get('id', '')[:8],  # Short ID
+        job.get('customer_name', ''),
+        job.get('contact_number', ''),
+        f"{job.get('car_brand', '')} {job.get('car_model', '')} ({job.get('year', '')})",
+        job.get('registration_number', ''),
+        job.get('vin', ''),
+        str(job.get('kms', '')) if job.get('kms') else '',
+        job.get('entry_date', ''),
+        job.get('assigned_mechanic', ''),
+        job.get('work_description', ''),
+        job.get('estimated_delivery', ''),
+        job.get('status', ''),
+        f"₹{job.get('invoice_amount', 0):,.2f}" if job.get('invoice_amount') else '',
+        job.get('notes', ''),
+        job.get('completion_date', ''),
+        job.get('created_at', '')
+    ]
+
 # ===== AUTHENTICATION ENDPOINTS =====
 
-@api_router.post("/auth/register", response_model=User)
-async def register(user_data: UserCreate):
+async def create_user(user_data: UserCreate, branch: str) -> User:
     existing_user = await db.users.find_one({"username": user_data.username})
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
@@ -225,18 +915,35 @@ async def register(user_data: UserCreate):
     password = user_dict.pop("password")
     user_dict["password_hash"] = hash_password(password)
     user_dict["id"] = str(uuid.uuid4())
+    user_dict["branch"] = branch
     
     await db.users.insert_one(user_dict)
+    await cache.invalidate("mechanics", branch)
     
     return User(**{k: v for k, v in user_dict.items() if k != "password_hash"})
 
+@api_router.post("/auth/register", response_model=User)
+async def register(user_data: UserCreate, current_user: User = Depends(require_manager)):
+    # Managers only add staff to their own branch; new branches get their first manager from POST /branches
+    return await create_user(user_data, current_user.branch)
+
 @api_router.post("/auth/login", response_model=LoginResponse)
-async def login(login_data: LoginRequest):
-    user = await db.users.find_one({"username": login_data.username})
-    if not user or not verify_password(login_data.password, user["password_hash"]):
-        raise HTTPException(status_code=401, detail="Incorrect username or password")
+async def login(login_data: LoginRequest, request: Request):
+    await enforce_rate_limit(request, "login")
+    await enforce_login_failure_limit(request, login_data.username)
+    
+    async with concurrency_limit("login"):
+        user = await db.users.find_one({"username": login_data.username})
+        # bcrypt is deliberately slow, keep it off the event loop
+        if not user or not await run_in_threadpool(verify_password, login_data.password, user["password_hash"]):
+            await enforce_login_failure_limit(request, login_data.username, failed=True)
+            raise HTTPException(status_code=401, detail="Incorrect username or password")
     
-    access_token = create_access_token(data={"sub": user["username"], "role": user["role"]})
+    access_token = create_access_token(data={
+        "sub": user["username"],
+        "role": user["role"],
+        "branch": user.get("branch", DEFAULT_BRANCH)
+    })
     
     user_obj = User(**{k: v for k, v in user.items() if k not in ["_id", "password_hash"]})
     
@@ -250,9 +957,85 @@ async def login(login_data: LoginRequest):
 
 @api_router.get("/mechanics", response_model=List[User])
 async def get_mechanics(current_user: User = Depends(get_current_user)):
-    mechanics = await db.users.find({"role": "Mechanic"}, {"_id": 0, "password_hash": 0}).to_list(1000)
+    async def load_mechanics():
+        return await db.users.find(
+            branch_query(current_user, role="Mechanic"), {"_id": 0, "password_hash": 0}
+        ).to_list(1000)
+    
+    mechanics = await cache.get_or_load("mechanics", current_user.branch, load_mechanics)
     return [User(**m) for m in mechanics]
 
+async def check_mechanic_access(current_user: User, username: str):
+    """Mechanics only see their own jobs, managers only the mechanics of their branch"""
+    if current_user.role == "Mechanic":
+        if current_user.username != username:
+            raise HTTPException(status_code=403, detail="Access denied")
+    elif not await db.users.find_one(branch_query(current_user, username=username, role="Mechanic"), {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Mechanic not found")
+
+@api_router.get("/mechanics/{username}/queue", response_model=MechanicQueue)
+async def get_mechanic_queue(username: str, page: int = 1, page_size: int = 20, current_user: User = Depends(get_current_user)):
+    """Mechanic's active jobs: overdue first by estimated delivery, then the rest by entry date"""
+    await check_mechanic_access(current_user, username)
+    
+    page = max(1, page)
+    page_size = max(1, min(page_size, 100))
+    offset = (page - 1) * page_size
+    
+    today = datetime.now(WORKSHOP_TIMEZONE).strftime("%Y-%m-%d")
+    query = branch_query(current_user, mechanic=username)
+    overdue_query = {**query, "estimated_delivery": {"$lt": today}}
+    upcoming_query = {**query, "estimated_delivery": {"$gte": today}}
+    
+    total = await db.mechanic_queue.count_documents(query)
+    overdue_count = await db.mechanic_queue.count_documents(overdue_query)
+    
+    # The queue is two index-ordered segments; a page may span the boundary
+    items = []
+    if offset < overdue_count:
+        overdue = await db.mechanic_queue.find(overdue_query, {"_id": 0}).sort(
+            [("estimated_delivery", 1), ("entry_date", 1)]
+        ).skip(offset).limit(page_size).to_list(page_size)
+        items = [QueueEntry(**entry, overdue=True) for entry in overdue]
+    
+    remaining = page_size - len(items)
+    if remaining > 0:
+        upcoming = await db.mechanic_queue.find(upcoming_query, {"_id": 0}).sort(
+            [("entry_date", 1), ("estimated_delivery", 1)]
+        ).skip(max(0, offset - overdue_count)).limit(remaining).to_list(remaining)
+        items += [QueueEntry(**entry) for entry in upcoming]
+    
+    return MechanicQueue(
+        mechanic=username,
+        total=total,
+        overdue_count=overdue_count,
+        page=page,
+        page_size=page_size,
+        items=items
+    )
+
+@api_router.get("/mechanics/{username}/completed", response_model=CompletedJobs)
+async def get_completed_jobs(username: str, page: int = 1, page_size: int = 20, current_user: User = Depends(get_current_user)):
+    """Mechanic's Done and Delivered jobs, most recently completed first, without photos"""
+    await check_mechanic_access(current_user, username)
+    
+    page = max(1, page)
+    page_size = max(1, min(page_size, 100))
+    
+    query = branch_query(current_user, assigned_mechanic=username, status={"$in": ["Done", "Delivered"]})
+    total = await db.jobs.count_documents(query)
+    jobs = await db.jobs.find(query, {"_id": 0, "photos": 0}).sort(
+        [("completion_date", -1), ("id", -1)]
+    ).skip((page - 1) * page_size).limit(page_size).to_list(page_size)
+    
+    return CompletedJobs(
+        mechanic=username,
+        total=total,
+        page=page,
+        page_size=page_size,
+        items=[Job(**j) for j in jobs]
+    )
+
 @api_router.get("/users/me", response_model=User)
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
     return current_user
@@ -261,17 +1044,20 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 
 @api_router.post("/jobs", response_model=Job)
 async def create_job(job_data: JobCreate, current_user: User = Depends(require_manager)):
+    await ensure_branch_mechanic(current_user, job_data.assigned_mechanic)
     job_dict = job_data.model_dump()
-    job = Job(**job_dict)
+    job = Job(**job_dict, branch=current_user.branch)
     
     doc = job.model_dump()
     await db.jobs.insert_one(doc)
+    await sync_mechanic_queue(doc)
+    await record_job_event(job.id, "created", current_user.username, to_status=job.status)
     
     return job
 
 @api_router.get("/jobs", response_model=List[Job])
 async def get_jobs(status: Optional[str] = None, current_user: User = Depends(get_current_user)):
-    query = {}
+    query = branch_query(current_user)
     
     # Mechanics can only see their assigned jobs
     if current_user.role == "Mechanic":
@@ -290,7 +1076,10 @@ async def get_jobs(status: Optional[str] = None, current_user: User = Depends(ge
 
 @api_router.get("/jobs/{job_id}", response_model=Job)
 async def get_job(job_id: str, current_user: User = Depends(get_current_user)):
-    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    job = await cache.get_or_load(
+        "job", f"{current_user.branch}:{job_id}",
+        lambda: db.jobs.find_one(branch_query(current_user, id=job_id), {"_id": 0})
+    )
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
@@ -302,7 +1091,7 @@ async def get_job(job_id: str, current_user: User = Depends(get_current_user)):
 
 @api_router.put("/jobs/{job_id}", response_model=Job)
 async def update_job(job_id: str, job_update: JobUpdate, current_user: User = Depends(get_current_user)):
-    job = await db.jobs.find_one({"id": job_id})
+    job = await db.jobs.find_one(branch_query(current_user, id=job_id), {"_id": 0, "photos": 0})
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
@@ -315,20 +1104,92 @@ async def update_job(job_id: str, job_update: JobUpdate, current_user: User = De
         update_data = {k: v for k, v in job_update.model_dump(exclude_unset=True).items() if k in allowed_fields}
     else:
         update_data = job_update.model_dump(exclude_unset=True)
+        if "assigned_mechanic" in update_data and update_data["assigned_mechanic"] != job["assigned_mechanic"]:
+            await ensure_branch_mechanic(current_user, update_data["assigned_mechanic"])
     
     # Auto-set completion_date when status becomes "Done"
     if update_data.get("status") == "Done" and job.get("status") != "Done":
         update_data["completion_date"] = datetime.now(timezone.utc).isoformat()
     
     if update_data:
-        await db.jobs.update_one({"id": job_id}, {"$set": update_data})
+        updated_job = await db.jobs.find_one_and_update(
+            branch_query(current_user, id=job_id),
+            {"$set": update_data, "$inc": {"version": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if not updated_job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        await cache.invalidate("job", f"{current_user.branch}:{job_id}")
+        # Status, reassignment and date changes all move the job in or out of a queue
+        await sync_mechanic_queue(updated_job)
+    else:
+        updated_job = await db.jobs.find_one(branch_query(current_user, id=job_id), {"_id": 0})
+    
+    if "status" in update_data and update_data["status"] != job.get("status"):
+        await record_job_event(
+            job_id, "status", current_user.username,
+            from_status=job.get("status"), to_status=update_data["status"]
+        )
     
-    updated_job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
     return Job(**updated_job)
 
+@api_router.post("/jobs/{job_id}/notes", response_model=JobEvent)
+async def add_job_note(job_id: str, note_data: NoteAdd, current_user: User = Depends(get_current_user)):
+    job = await db.jobs.find_one(branch_query(current_user, id=job_id), {"_id": 0, "assigned_mechanic": 1})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if current_user.role == "Mechanic" and job["assigned_mechanic"] != current_user.username:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    note = note_data.note.strip()
+    if not note:
+        raise HTTPException(status_code=400, detail="Note cannot be empty")
+    
+    return await record_job_event(job_id, "note", current_user.username, message=note)
+
+@api_router.get("/jobs/{job_id}/events", response_model=JobEventPage)
+async def get_job_events(
+    job_id: str,
+    before_ts: Optional[str] = None,
+    before_id: Optional[str] = None,
+    limit: int = 20,
+    current_user: User = Depends(get_current_user)
+):
+    """Activity log for a job, newest first. Page through older events with `before_ts`/`before_id`"""
+    job = await db.jobs.find_one(branch_query(current_user, id=job_id), {"_id": 0, "assigned_mechanic": 1})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if current_user.role == "Mechanic" and job["assigned_mechanic"] != current_user.username:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    limit = max(1, min(limit, 100))
+    query = {"job_id": job_id}
+    if before_ts and before_id:
+        # Events can share a timestamp, so the cursor is (ts, id) to keep page boundaries exact
+        query["$or"] = [
+            {"ts": {"$lt": before_ts}},
+            {"ts": before_ts, "id": {"$lt": before_id}}
+        ]
+    elif before_ts or before_id:
+        raise HTTPException(status_code=400, detail="before_ts and before_id must be passed together")
+    
+    # Fetch one extra to know whether an older page exists
+    events = await db.job_events.find(query, {"_id": 0}).sort([("ts", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+    has_more = len(events) > limit
+    events = events[:limit]
+    
+    return JobEventPage(
+        events=[JobEvent(**e) for e in events],
+        next_before_ts=events[-1]["ts"] if has_more else None,
+        next_before_id=events[-1]["id"] if has_more else None
+    )
+
 @api_router.post("/jobs/{job_id}/photos")
 async def add_job_photo(job_id: str, photo: UploadFile = File(...), current_user: User = Depends(get_current_user)):
-    job = await db.jobs.find_one({"id": job_id})
+    job = await db.jobs.find_one(branch_query(current_user, id=job_id), {"_id": 0, "id": 1})
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
@@ -339,32 +1200,37 @@ async def add_job_photo(job_id: str, photo: UploadFile = File(...), current_user
     
     # Add to photos array
     await db.jobs.update_one(
-        {"id": job_id},
+        branch_query(current_user, id=job_id),
         {"$push": {"photos": image_url}}
     )
+    await cache.invalidate("job", f"{current_user.branch}:{job_id}")
+    await record_job_event(job_id, "photo", current_user.username, message=photo.filename)
     
     return {"message": "Photo added successfully", "photo_url": image_url}
 
 @api_router.delete("/jobs/{job_id}")
 async def delete_job(job_id: str, current_user: User = Depends(require_manager)):
-    result = await db.jobs.delete_one({"id": job_id})
-    if result.deleted_count == 0:
+    deleted = await db.jobs.find_one_and_delete(branch_query(current_user, id=job_id), projection={"_id": 0, "id": 1, "version": 1})
+    if not deleted:
         raise HTTPException(status_code=404, detail="Job not found")
+    await cache.invalidate("job", f"{current_user.branch}:{job_id}")
+    # Tombstone past the last version, in case an update of the job is still syncing
+    await sync_mechanic_queue({"id": job_id, "version": deleted.get("version", 0) + 1, "status": None})
+    await db.job_events.delete_many({"job_id": job_id})
     return {"message": "Job deleted successfully"}
 
 # ===== STATISTICS ENDPOINT =====
 
 @api_router.get("/stats")
 async def get_stats(current_user: User = Depends(get_current_user)):
-    query = {}
+    query = branch_query(current_user)
     if current_user.role == "Mechanic":
         query["assigned_mechanic"] = current_user.username
     
-    all_jobs = await db.jobs.find(query, {"_id": 0}).to_list(1000)
-    
-    active_count = sum(1 for j in all_jobs if j.get("status") in ["Pending", "In Progress"])
-    completed_count = sum(1 for j in all_jobs if j.get("status") in ["Done", "Delivered"])
-    total_count = len(all_jobs)
+    # Counted on the (branch, [assigned_mechanic,] status) indexes, no documents are loaded
+    active_count = await db.jobs.count_documents({**query, "status": {"$in": QUEUE_STATUSES}})
+    completed_count = await db.jobs.count_documents({**query, "status": {"$in": ["Done", "Delivered"]}})
+    total_count = await db.jobs.count_documents(query)
     
     return {
         "active": active_count,
@@ -372,6 +1238,14 @@ async def get_stats(current_user: User = Depends(get_current_user)):
         "total": total_count
     }
 
+@api_router.get("/cache/stats")
+async def get_cache_stats(current_user: User = Depends(require_manager)):
+    """Hit rates of the read-through cache across all workers"""
+    return {
+        "backend": CACHE_BACKEND,
+        "namespaces": await cache.get_stats()
+    }
+
 # ===== NOTIFICATION ENDPOINTS (MOCK) =====
 
 @api_router.post("/notifications/whatsapp")
@@ -380,7 +1254,7 @@ async def send_whatsapp(request: WhatsAppRequest, current_user: User = Depends(r
     # TODO: Add WhatsApp Business API credentials in .env
     # WHATSAPP_API_KEY, WHATSAPP_PHONE_NUMBER_ID
     
-    job = await db.jobs.find_one({"id": request.job_id}, {"_id": 0})
+    job = await db.jobs.find_one(branch_query(current_user, id=request.job_id), {"_id": 0})
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
@@ -399,7 +1273,7 @@ async def send_invoice_email(job_id: str, current_user: User = Depends(require_m
     # TODO: Add Mailchimp credentials in .env
     # MAILCHIMP_API_KEY
     
-    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    job = await db.jobs.find_one(branch_query(current_user, id=job_id), {"_id": 0})
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
@@ -411,10 +1285,44 @@ async def send_invoice_email(job_id: str, current_user: User = Depends(require_m
         "recipient": job.get('customer_name')
     }
 
+def write_jobs_worksheet(sheet, worksheet_title: str, jobs: list, exported_by: str):
+    """Replace the worksheet's contents with the jobs. Blocking, run it in the threadpool"""
+    try:
+        worksheet = sheet.worksheet(worksheet_title)
+    except:
+        worksheet = sheet.add_worksheet(title=worksheet_title, rows=1000, cols=20)
+    
+    # Clear existing data
+    worksheet.clear()
+    
+    # Prepare headers and data rows
+    headers = EXPORT_HEADERS
+    data_rows = [job_export_row(job) for job in jobs]
+    
+    # Update sheet with headers and data
+    all_data = [headers] + data_rows
+    worksheet.update('A1', all_data)
+    
+    # Format the header row
+    worksheet.format('A1:P1', {
+        "backgroundColor": {"red": 0.82, "green": 0.18, "blue": 0.18},  # Red
+        "textFormat": {"bold": True, "foregroundColor": {"red": 1, "green": 1, "blue": 1}},
+        "horizontalAlignment": "CENTER"
+    })
+    
+    # Auto-resize columns
+    worksheet.columns_auto_resize(0, len(headers))
+    
+    # Add timestamp
+    export_time = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+    worksheet.update('A' + str(len(data_rows) + 3), [[f"Exported by: {exported_by} on {export_time}"]])
+
 @api_router.post("/export/google-sheets")
-async def export_to_sheets(current_user: User = Depends(require_manager)):
+async def export_to_sheets(request: Request, current_user: User = Depends(require_manager)):
     """Export all jobs to Google Sheets"""
     
+    await enforce_rate_limit(request, "export", current_user.username)
+    
     if not GOOGLE_SHEETS_ENABLED:
         return {
             "success": False,
@@ -428,127 +1336,302 @@ async def export_to_sheets(current_user: User = Depends(require_manager)):
             "message": "GOOGLE_SHEET_ID not set in environment variables"
         }
     
-    try:
-        # Get all jobs
-        jobs = await db.jobs.find({}, {"_id": 0}).to_list(1000)
-        
-        if not jobs:
-            return {
-                "success": False,
-                "message": "No jobs found to export"
-            }
-        
-        # Initialize Google Sheets client
-        client = get_google_sheets_client()
-        if not client:
+    async with concurrency_limit("export"):
+        try:
+            # Get all jobs of the branch
+            jobs = await db.jobs.find(branch_query(current_user), {"_id": 0}).to_list(1000)
+            
+            if not jobs:
+                return {
+                    "success": False,
+                    "message": "No jobs found to export"
+                }
+            
+            # gspread makes blocking HTTP calls, keep them off the event loop
+            client = await run_in_threadpool(get_google_sheets_client)
+            if not client:
+                return {
+                    "success": False,
+                    "message": "Failed to initialize Google Sheets client. Check credentials."
+                }
+            
+            # Open the spreadsheet
+            try:
+                sheet = await run_in_threadpool(client.open_by_key, GOOGLE_SHEET_ID)
+            except Exception as e:
+                return {
+                    "success": False,
+                    "message": f"Failed to open Google Sheet. Make sure the Sheet ID is correct and shared with the service account. Error: {str(e)}"
+                }
+            
+            # Get or create the branch's worksheet
+            worksheet_title = "ICD Tuning Jobs"
+            if current_user.branch != DEFAULT_BRANCH:
+                worksheet_title = f"ICD Tuning Jobs - {current_user.branch}"
+            await run_in_threadpool(write_jobs_worksheet, sheet, worksheet_title, jobs, current_user.full_name)
+            
+            logging.info(f"Successfully exported {len(jobs)} jobs to Google Sheets by {current_user.username}")
+            
             return {
-                "success": False,
-                "message": "Failed to initialize Google Sheets client. Check credentials."
+                "success": True,
+                "message": f"Successfully exported {len(jobs)} jobs to Google Sheets",
+                "job_count": len(jobs),
+                "sheet_url": f"https://docs.google.com/spreadsheets/d/{GOOGLE_SHEET_ID}"
             }
-        
-        # Open the spreadsheet
-        try:
-            sheet = client.open_by_key(GOOGLE_SHEET_ID)
+            
         except Exception as e:
+            logging.error(f"Error exporting to Google Sheets: {str(e)}")
             return {
                 "success": False,
-                "message": f"Failed to open Google Sheet. Make sure the Sheet ID is correct and shared with the service account. Error: {str(e)}"
+                "message": f"Failed to export to Google Sheets: {str(e)}"
             }
+
+# ===== FILE EXPORT =====
+
+EXPORT_BATCH_SIZE = 500
+
+# Photos are never exported and make up most of a job document
+EXPORT_PROJECTION = {"_id": 0, "photos": 0}
+
+XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="ICD Tuning Jobs" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+# Control characters are not allowed in XML 1.0 text
+XML_ILLEGAL_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+class ChunkSink(io.RawIOBase):
+    """Unseekable file object that collects what is written so it can be streamed out in chunks"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def build_export_query(current_user: User, date_from: Optional[str], date_to: Optional[str], status: Optional[str], mechanic: Optional[str]) -> dict:
+    query = branch_query(current_user)
+    
+    entry_date = {}
+    for bound, value in (("$gte", date_from), ("$lte", date_to)):
+        if value:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Dates must be in YYYY-MM-DD format")
+            entry_date[bound] = value
+    if entry_date:
+        query["entry_date"] = entry_date
+    
+    if status and status != "All Status":
+        query["status"] = status
+    
+    if mechanic:
+        query["assigned_mechanic"] = mechanic
+    
+    return query
+
+async def iter_export_rows(query: dict):
+    """Yield export rows straight off the cursor, one batch in memory at a time"""
+    cursor = db.jobs.find(query, EXPORT_PROJECTION).sort("entry_date", 1).batch_size(EXPORT_BATCH_SIZE)
+    async for job in cursor:
+        yield job_export_row(job)
+
+async def stream_jobs_csv(query: dict):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens the file as UTF-8 (the ₹ sign)
+    buffer.write("\ufeff")
+    writer.writerow(EXPORT_HEADERS)
+    
+    row_count = 0
+    async for row in iter_export_rows(query):
+        writer.writerow(row)
+        row_count += 1
+        if row_count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    
+    yield buffer.getvalue().encode("utf-8")
+
+def xlsx_row(values: list) -> str:
+    cells = "".join(
+        '<c t="inlineStr"><is><t xml:space="preserve">'
+        + xml_escape(XML_ILLEGAL_CHARS.sub("", "" if value is None else str(value)))
+        + '</t></is></c>'
+        for value in values
+    )
+    return f"<row>{cells}</row>"
+
+async def stream_jobs_xlsx(query: dict):
+    """Write a single-sheet workbook into a zip stream, yielding compressed bytes as each batch is added"""
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_STATIC_PARTS.items():
+            archive.writestr(name, content)
+        yield sink.drain()
         
-        # Get or create worksheet
-        try:
-            worksheet = sheet.worksheet("ICD Tuning Jobs")
-        except:
-            worksheet = sheet.add_worksheet(title="ICD Tuning Jobs", rows=1000, cols=20)
-        
-        # Clear existing data
-        worksheet.clear()
-        
-        # Prepare headers
-        headers = [
-            "Job ID",
-            "Customer Name",
-            "Contact Number",
-            "Vehicle",
-            "Registration No",
-            "VIN",
-            "Odometer (KMs)",
-            "Entry Date",
-            "Assigned Mechanic",
-            "Work Description",
-            "Estimated Delivery",
-            "Status",
-            "Invoice Amount",
-            "Notes",
-            "Completion Date",
-            "Created At"
-        ]
-        
-        # Prepare data rows
-        data_rows = []
-        for job in jobs:
-            row = [
-                job.get('id', '')[:8],  # Short ID
-                job.get('customer_name', ''),
-                job.get('contact_number', ''),
-                f"{job.get('car_brand', '')} {job.get('car_model', '')} ({job.get('year', '')})",
-                job.get('registration_number', ''),
-                job.get('vin', ''),
-                str(job.get('kms', '')) if job.get('kms') else '',
-                job.get('entry_date', ''),
-                job.get('assigned_mechanic', ''),
-                job.get('work_description', ''),
-                job.get('estimated_delivery', ''),
-                job.get('status', ''),
-                f"₹{job.get('invoice_amount', 0):,.2f}" if job.get('invoice_amount') else '',
-                job.get('notes', ''),
-                job.get('completion_date', ''),
-                job.get('created_at', '')
-            ]
-            data_rows.append(row)
-        
-        # Update sheet with headers and data
-        all_data = [headers] + data_rows
-        worksheet.update('A1', all_data)
-        
-        # Format the header row
-        worksheet.format('A1:P1', {
-            "backgroundColor": {"red": 0.82, "green": 0.18, "blue": 0.18},  # Red
-            "textFormat": {"bold": True, "foregroundColor": {"red": 1, "green": 1, "blue": 1}},
-            "horizontalAlignment": "CENTER"
-        })
-        
-        # Auto-resize columns
-        worksheet.columns_auto_resize(0, len(headers))
-        
-        # Add timestamp
-        export_time = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-        worksheet.update('A' + str(len(data_rows) + 3), [[f"Exported by: {current_user.full_name} on {export_time}"]])
-        
-        logging.info(f"Successfully exported {len(jobs)} jobs to Google Sheets by {current_user.username}")
-        
-        return {
-            "success": True,
-            "message": f"Successfully exported {len(jobs)} jobs to Google Sheets",
-            "job_count": len(jobs),
-            "sheet_url": f"https://docs.google.com/spreadsheets/d/{GOOGLE_SHEET_ID}"
-        }
-        
-    except Exception as e:
-        logging.error(f"Error exporting to Google Sheets: {str(e)}")
-        return {
-            "success": False,
-            "message": f"Failed to export to Google Sheets: {str(e)}"
-        }
+        with archive.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                + xlsx_row(EXPORT_HEADERS)
+            ).encode("utf-8"))
+            
+            row_count = 0
+            async for row in iter_export_rows(query):
+                sheet.write(xlsx_row(row).encode("utf-8"))
+                row_count += 1
+                if row_count % EXPORT_BATCH_SIZE == 0:
+                    yield sink.drain()
+            
+            sheet.write(b"</sheetData></worksheet>")
+    
+    yield sink.drain()
+
+@api_router.get("/export/jobs.csv")
+async def export_jobs_csv(
+    request: Request,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    status: Optional[str] = None,
+    mechanic: Optional[str] = None,
+    current_user: User = Depends(require_manager)
+):
+    """Stream jobs as CSV, filtered by entry date range, status and assigned mechanic"""
+    await enforce_rate_limit(request, "export", current_user.username)
+    query = build_export_query(current_user, date_from, date_to, status, mechanic)
+    
+    # Held for the whole stream, released by the generator
+    token = await acquire_concurrency_slot("export")
+    
+    filename = f"icd_jobs_{datetime.now().strftime('%Y%m%d')}.csv"
+    return StreamingResponse(
+        release_slot_after(stream_jobs_csv(query), "export", token),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+@api_router.get("/export/jobs.xlsx")
+async def export_jobs_xlsx(
+    request: Request,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    status: Optional[str] = None,
+    mechanic: Optional[str] = None,
+    current_user: User = Depends(require_manager)
+):
+    """Stream jobs as an Excel workbook, filtered by entry date range, status and assigned mechanic"""
+    await enforce_rate_limit(request, "export", current_user.username)
+    query = build_export_query(current_user, date_from, date_to, status, mechanic)
+    
+    # Held for the whole stream, released by the generator
+    token = await acquire_concurrency_slot("export")
+    
+    filename = f"icd_jobs_{datetime.now().strftime('%Y%m%d')}.xlsx"
+    return StreamingResponse(
+        release_slot_after(stream_jobs_xlsx(query), "export", token),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+# ===== BRANCH ENDPOINTS =====
+
+async def get_branch_profile(branch: str) -> BranchProfile:
+    """Invoice identity of the branch, falling back to the original ICD Tuning details"""
+    profile = await cache.get_or_load(
+        "branch", branch, lambda: db.branches.find_one({"branch": branch}, {"_id": 0})
+    )
+    return BranchProfile(**(profile or DEFAULT_BRANCH_PROFILE))
+
+@api_router.get("/branch", response_model=BranchProfile)
+async def get_branch(current_user: User = Depends(require_manager)):
+    return await get_branch_profile(current_user.branch)
+
+@api_router.put("/branch", response_model=BranchProfile)
+async def update_branch(profile: BranchProfile, current_user: User = Depends(require_manager)):
+    await db.branches.replace_one(
+        {"branch": current_user.branch},
+        {"branch": current_user.branch, **profile.model_dump()},
+        upsert=True
+    )
+    await cache.invalidate("branch", current_user.branch)
+    return profile
+
+def require_head_office(current_user: User = Depends(require_manager)):
+    if current_user.branch != DEFAULT_BRANCH:
+        raise HTTPException(status_code=403, detail="Head office manager access required")
+    return current_user
+
+@api_router.post("/branches", response_model=BranchCreated)
+async def create_branch(branch_data: BranchCreate, current_user: User = Depends(require_head_office)):
+    """Open a new branch with its invoice profile and first manager"""
+    branch = branch_data.branch.strip().lower()
+    if not BRANCH_ID_PATTERN.match(branch):
+        raise HTTPException(status_code=400, detail="Branch id must be lowercase letters, digits and dashes")
+    if branch == DEFAULT_BRANCH or await db.users.find_one({"branch": branch}, {"_id": 1}):
+        raise HTTPException(status_code=400, detail="Branch already exists")
+    if await db.users.find_one({"username": branch_data.manager.username}, {"_id": 1}):
+        raise HTTPException(status_code=400, detail="Username already exists")
+    
+    try:
+        await db.branches.insert_one({"branch": branch, **branch_data.profile.model_dump()})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Branch already exists")
+    await cache.invalidate("branch", branch)
+    
+    manager = await create_user(branch_data.manager.model_copy(update={"role": "Manager"}), branch)
+    return BranchCreated(branch=branch, profile=branch_data.profile, manager=manager)
 
 # ===== INVOICE GENERATION =====
 
 @api_router.post("/jobs/{job_id}/invoice")
-async def generate_invoice(job_id: str, invoice_data: InvoiceData, current_user: User = Depends(require_manager)):
-    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+async def generate_invoice(job_id: str, invoice_data: InvoiceData, request: Request, current_user: User = Depends(require_manager)):
+    await enforce_rate_limit(request, "invoice", current_user.username)
+    
+    job = await db.jobs.find_one(branch_query(current_user, id=job_id), {"_id": 0})
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
+    branch = await get_branch_profile(current_user.branch)
+    
     # Create PDF
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=30)
@@ -577,10 +1660,10 @@ async def generate_invoice(job_id: str, invoice_data: InvoiceData, current_user:
     )
     
     # Header
-    elements.append(Paragraph("ICD TUNING", title_style))
-    elements.append(Paragraph("Performance Tuning | ECU Remaps | Custom Builds", header_style))
-    elements.append(Paragraph("Chennai, Tamil Nadu", header_style))
-    elements.append(Paragraph("📞 +91 98765 43210 ✉️ icdtuning@gmail.com", header_style))
+    elements.append(Paragraph(branch.name.upper(), title_style))
+    elements.append(Paragraph(branch.tagline, header_style))
+    elements.append(Paragraph(branch.address, header_style))
+    elements.append(Paragraph(f"📞 {branch.phone} ✉️ {branch.email}", header_style))
     elements.append(Spacer(1, 0.5*inch))
     
     # Invoice title
@@ -588,7 +1671,7 @@ async def generate_invoice(job_id: str, invoice_data: InvoiceData, current_user:
     elements.append(Spacer(1, 0.3*inch))
     
     # Invoice details
-    invoice_number = f"ICD-{datetime.now().year}-{job_id[:8].upper()}"
+    invoice_number = f"{branch.invoice_prefix}-{datetime.now().year}-{job_id[:8].upper()}"
     invoice_date = datetime.now().strftime("%d/%m/%Y")
     
     details_data = [
@@ -689,11 +1772,12 @@ async def generate_invoice(job_id: str, invoice_data: InvoiceData, current_user:
         alignment=TA_CENTER,
     )
     elements.append(Paragraph("Terms & Conditions:", footer_style))
-    elements.append(Paragraph("All tuning work done by ICD Tuning is tested and verified for safety and performance.", footer_style))
+    elements.append(Paragraph(f"All tuning work done by {branch.name} is tested and verified for safety and performance.", footer_style))
     elements.append(Spacer(1, 0.2*inch))
-    elements.append(Paragraph("Thank you for choosing ICD Tuning!", footer_style))
+    elements.append(Paragraph(f"Thank you for choosing {branch.name}!", footer_style))
     
-    doc.build(elements)
+    async with concurrency_limit("invoice"):
+        await run_in_threadpool(doc.build, elements)
     buffer.seek(0)
     
     return StreamingResponse(
@@ -702,6 +1786,160 @@ async def generate_invoice(job_id: str, invoice_data: InvoiceData, current_user:
         headers={"Content-Disposition": f"attachment; filename=invoice_{invoice_number}.pdf"}
     )
 
+# ===== REQUEST PROFILING =====
+
+class RequestProfilerMiddleware:
+    """Run manager-requested requests under a sampling profiler and store the result.
+
+    Requests without the opt-in header or query flag are passed straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        
+        manager = await self.get_manager(scope)
+        if manager is None:
+            await self.app(scope, receive, send)
+            return
+        
+        profile_id = str(uuid.uuid4())
+        response_status = {}
+        
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                response_status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+        
+        recording = {"pending": {}, "calls": [], "count": 0, "total_ms": 0.0}
+        token = profiled_mongo_calls.set(recording)
+        profiler = Profiler(interval=PROFILE_SAMPLE_INTERVAL, async_mode="enabled")
+        started_at = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.stop()
+            duration_ms = (time.perf_counter() - started_at) * 1000
+            profiled_mongo_calls.reset(token)
+            try:
+                await self.store_profile(
+                    profile_id, scope, manager, response_status.get("code"),
+                    duration_ms, recording, profiler
+                )
+            except Exception as e:
+                # The X-Profile-Id header has already gone out; the id will 404
+                logging.error(f"Failed to store request profile {profile_id}: {str(e)}")
+
+    @staticmethod
+    def wants_profile(scope) -> bool:
+        query_string = scope.get("query_string", b"")
+        if PROFILE_QUERY_FLAG in query_string:
+            flags = parse_qs(query_string.decode("latin-1")).get("profile", [])
+            if any(flag in ("1", "true") for flag in flags):
+                return True
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return value in (b"1", b"true")
+        return False
+
+    @staticmethod
+    async def get_manager(scope) -> Optional[dict]:
+        """The manager behind the request's bearer token, None for anyone else"""
+        authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.PyJWTError:
+            return None
+        user = await db.users.find_one({"username": payload.get("sub")}, {"_id": 0, "username": 1, "role": 1, "branch": 1})
+        if not user or user["role"] != "Manager":
+            return None
+        return user
+
+    @staticmethod
+    async def store_profile(profile_id, scope, manager, status_code, duration_ms, recording, profiler):
+        now = datetime.now(timezone.utc)
+        
+        # Profile documents expire through their TTL index, GridFS files are removed here
+        cutoff = now - timedelta(days=PROFILE_RETENTION_DAYS)
+        async for expired in db.profile_flamegraphs.files.find({"uploadDate": {"$lt": cutoff}}, {"_id": 1}):
+            await profile_files.delete(expired["_id"])
+        
+        # Rendering walks every sample, keep it off the event loop
+        speedscope = await run_in_threadpool(profiler.output, SpeedscopeRenderer())
+        file_id = await profile_files.upload_from_stream(
+            f"profile_{profile_id}.speedscope.json",
+            speedscope.encode("utf-8"),
+            metadata={"profile_id": profile_id}
+        )
+        
+        await db.request_profiles.insert_one({
+            "id": profile_id,
+            "method": scope["method"],
+            "path": scope["path"],
+            "query_string": scope.get("query_string", b"").decode("latin-1"),
+            "username": manager["username"],
+            "branch": manager.get("branch", DEFAULT_BRANCH),
+            "status_code": status_code,
+            "duration_ms": round(duration_ms, 3),
+            "mongo_calls": recording["calls"],
+            "mongo_call_count": recording["count"],
+            "mongo_calls_truncated": recording["count"] > len(recording["calls"]),
+            "mongo_total_ms": round(recording["total_ms"], 3),
+            "speedscope_file_id": file_id,
+            "created_at": now.isoformat(),
+            "expires_at": now + timedelta(days=PROFILE_RETENTION_DAYS)
+        })
+
+# Everything except the (large) flamegraph itself
+PROFILE_SUMMARY_PROJECTION = {"_id": 0, "speedscope_file_id": 0, "expires_at": 0}
+
+@api_router.get("/profiles")
+async def list_profiles(limit: int = 50, current_user: User = Depends(require_manager)):
+    limit = max(1, min(limit, 200))
+    profiles = await db.request_profiles.find(
+        branch_query(current_user), {**PROFILE_SUMMARY_PROJECTION, "mongo_calls": 0}
+    ).sort("created_at", -1).limit(limit).to_list(limit)
+    return profiles
+
+@api_router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, current_user: User = Depends(require_manager)):
+    profile = await db.request_profiles.find_one(branch_query(current_user, id=profile_id), PROFILE_SUMMARY_PROJECTION)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+@api_router.get("/profiles/{profile_id}/speedscope")
+async def download_profile(profile_id: str, current_user: User = Depends(require_manager)):
+    """Download the flamegraph, open it at https://www.speedscope.app"""
+    profile = await db.request_profiles.find_one(branch_query(current_user, id=profile_id), {"_id": 0, "speedscope_file_id": 1})
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    
+    try:
+        flamegraph = await profile_files.open_download_stream(profile["speedscope_file_id"])
+    except NoFile:
+        # Expired files go before the TTL monitor removes their profile document
+        raise HTTPException(status_code=404, detail="Profile not found")
+    
+    async def read_chunks():
+        while chunk := await flamegraph.readchunk():
+            yield chunk
+    
+    return StreamingResponse(
+        read_chunks(),
+        media_type="application/json",
+        headers={"Content-Disposition": f"attachment; filename=profile_{profile_id}.speedscope.json"}
+    )
+
 # ===== SEED DATA ENDPOINT =====
 
 @api_router.post("/seed")
@@ -718,25 +1956,29 @@ async def seed_database():
             "username": "admin",
             "password_hash": hash_password("admin123"),
             "role": "Manager",
-            "full_name": "Admin Manager"
+            "full_name": "Admin Manager",
+            "branch": DEFAULT_BRANCH
         },
         {
             "id": str(uuid.uuid4()),
             "username": "rudhan",
             "password_hash": hash_password("rudhan123"),
             "role": "Mechanic",
-            "full_name": "Rudhan"
+            "full_name": "Rudhan",
+            "branch": DEFAULT_BRANCH
         },
         {
             "id": str(uuid.uuid4()),
             "username": "suresh",
             "password_hash": hash_password("suresh123"),
             "role": "Mechanic",
-            "full_name": "Suresh Babu"
+            "full_name": "Suresh Babu",
+            "branch": DEFAULT_BRANCH
         },
     ]
     
     await db.users.insert_many(users)
+    await cache.invalidate("mechanics", DEFAULT_BRANCH)
     
     # Create sample jobs
     jobs = [
@@ -760,6 +2002,7 @@ async def seed_database():
             "notes": "Customer wants improved fuel efficiency",
             "completion_date": "2025-10-27T10:30:00Z",
             "confirm_complete": True,
+            "branch": DEFAULT_BRANCH,
             "created_at": "2025-10-20T09:00:00Z"
         },
         {
@@ -782,11 +2025,14 @@ async def seed_database():
             "notes": None,
             "completion_date": None,
             "confirm_complete": False,
+            "branch": DEFAULT_BRANCH,
             "created_at": "2025-10-25T11:00:00Z"
         },
     ]
     
     await db.jobs.insert_many(jobs)
+    for job in jobs:
+        await sync_mechanic_queue(job)
     
     return {"message": "Database seeded successfully", "users": len(users), "jobs": len(jobs)}
 
@@ -800,14 +2046,61 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Id"],
 )
 
+app.add_middleware(RequestProfilerMiddleware)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def setup_rate_limiter():
+    await rate_limiter.setup()
+
+@app.on_event("startup")
+async def setup_cache():
+    await cache.backend.setup()
+
+@app.on_event("startup")
+async def create_indexes():
+    # Records from before branches existed belong to the default branch
+    for collection in (db.users, db.jobs):
+        await collection.update_many({"branch": {"$exists": False}}, {"$set": {"branch": DEFAULT_BRANCH}})
+    
+    # Every jobs/users query is branch-scoped, so indexes lead with the branch
+    await db.users.create_index("username")
+    await db.users.create_index([("branch", 1), ("role", 1)])
+    await db.jobs.create_index([("branch", 1), ("id", 1)])
+    await db.jobs.create_index([("branch", 1), ("status", 1)])
+    await db.jobs.create_index([("branch", 1), ("assigned_mechanic", 1), ("status", 1)])
+    await db.jobs.create_index([("branch", 1), ("assigned_mechanic", 1), ("completion_date", -1), ("id", -1)])
+    # File exports stream jobs in entry date order
+    await db.jobs.create_index([("branch", 1), ("entry_date", 1)])
+    await db.branches.create_index("branch", unique=True)
+    # Work queue is read per mechanic in two orders (overdue, then upcoming)
+    await db.mechanic_queue.create_index("job_id", unique=True)
+    await db.mechanic_queue.create_index([("branch", 1), ("mechanic", 1), ("estimated_delivery", 1), ("entry_date", 1)])
+    await db.mechanic_queue.create_index([("branch", 1), ("mechanic", 1), ("entry_date", 1)])
+    await db.mechanic_queue.create_index("removed_at", expireAfterSeconds=QUEUE_TOMBSTONE_SECONDS)
+    # Activity log is read newest first per job
+    await db.job_events.create_index([("job_id", 1), ("ts", -1), ("id", -1)])
+    # Stored profiles are listed newest first and expire after PROFILE_RETENTION_DAYS
+    await db.request_profiles.create_index("id", unique=True)
+    await db.request_profiles.create_index([("branch", 1), ("created_at", -1)])
+    await db.request_profiles.create_index("expires_at", expireAfterSeconds=0)
+
+@app.on_event("startup")
+async def build_mechanic_queue():
+    # One-off backfill for jobs created before the queue existed; afterwards job writes keep it current
+    if await db.mechanic_queue.estimated_document_count() > 0:
+        return
+    async for job in db.jobs.find({"status": {"$in": QUEUE_STATUSES}}, {"_id": 0, "photos": 0}):
+        await sync_mechanic_queue(job)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect, useCallback } from 'react';
 import axios from 'axios';
 import { toast } from 'sonner';
 import { Dialog, DialogContent, DialogHeader, DialogTitle } from './ui/dialog';
@@ -7,7 +7,7 @@ import { Input } from './ui/input';
 import { Textarea } from './ui/textarea';
 import { Label } from './ui/label';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from './ui/select';
-import { X, Camera, FileText, Edit, Save } from 'lucide-react';
+import { X, Camera, FileText, Edit, Save, History } from 'lucide-react';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -20,9 +20,12 @@ const CAR_BRANDS = [
 
 const JobDetailsModal = ({ job, open, onClose, onUpdate, isManager }) => {
   const [editMode, setEditMode] = useState(false);
-  const [notes, setNotes] = useState(job.notes || '');
+  const [note, setNote] = useState('');
   const [status, setStatus] = useState(job.status);
   const [updating, setUpdating] = useState(false);
+  const [events, setEvents] = useState([]);
+  const [nextBefore, setNextBefore] = useState(null);
+  const [loadingEvents, setLoadingEvents] = useState(false);
   
   // Editable fields for manager
   const [editData, setEditData] = useState({
@@ -72,31 +75,71 @@ const JobDetailsModal = ({ job, open, onClose, onUpdate, isManager }) => {
     }
   };
 
-  const handleUpdateNotes = async () => {
-    if (notes === job.notes) {
-      toast.info('No changes to save');
+  const fetchEvents = useCallback(async (before = null) => {
+    setLoadingEvents(true);
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.get(`${API}/jobs/${job.id}/events`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: before ? { before_ts: before.ts, before_id: before.id } : {},
+      });
+      setEvents(prev => (before ? [...prev, ...response.data.events] : response.data.events));
+      setNextBefore(
+        response.data.next_before_ts
+          ? { ts: response.data.next_before_ts, id: response.data.next_before_id }
+          : null
+      );
+    } catch (error) {
+      console.error('Error fetching activity:', error);
+    } finally {
+      setLoadingEvents(false);
+    }
+  }, [job.id]);
+
+  useEffect(() => {
+    if (open) {
+      fetchEvents();
+    }
+  }, [open, fetchEvents]);
+
+  const handleAddNote = async () => {
+    if (!note.trim()) {
+      toast.info('Write a note first');
       return;
     }
 
     setUpdating(true);
     try {
       const token = localStorage.getItem('token');
-      await axios.put(
-        `${API}/jobs/${job.id}`,
-        { notes },
+      const response = await axios.post(
+        `${API}/jobs/${job.id}/notes`,
+        { note },
         { headers: { Authorization: `Bearer ${token}` } }
       );
-      toast.success('Notes updated!');
-      onUpdate();
-      onClose();
+      toast.success('Note added!');
+      setEvents(prev => [response.data, ...prev]);
+      setNote('');
     } catch (error) {
-      console.error('Error updating notes:', error);
-      toast.error('Failed to update notes');
+      console.error('Error adding note:', error);
+      toast.error('Failed to add note');
     } finally {
       setUpdating(false);
     }
   };
 
+  const describeEvent = (event) => {
+    switch (event.type) {
+      case 'created':
+        return 'Job created';
+      case 'status':
+        return `Status changed from ${event.from_status} to ${event.to_status}`;
+      case 'photo':
+        return 'Photo added';
+      default:
+        return event.message;
+    }
+  };
+
   const handleUpdateStatus = async (newStatus) => {
     setUpdating(true);
     try {
@@ -447,22 +490,65 @@ const JobDetailsModal = ({ job, open, onClose, onUpdate, isManager }) => {
               </div>
 
               {/* Notes */}
+              {job.notes && (
+                <div>
+                  <h3 className="text-sm text-gray-400 mb-2">Notes</h3>
+                  <div className="bg-black/30 p-4 rounded-lg">
+                    <p className="text-white whitespace-pre-wrap">{job.notes}</p>
+                  </div>
+                </div>
+              )}
+
               <div>
                 <Label htmlFor="notes" className="text-white mb-2 flex items-center gap-2">
                   <FileText className="w-4 h-4" />
-                  Notes
+                  Add Note
                 </Label>
                 <Textarea
                   id="notes"
-                  value={notes}
-                  onChange={(e) => setNotes(e.target.value)}
-                  placeholder="Add job notes..."
-                  rows={4}
+                  value={note}
+                  onChange={(e) => setNote(e.target.value)}
+                  placeholder="Add a job note..."
+                  rows={3}
                   className="bg-black/50 border-gray-700 text-white"
                   data-testid="notes-textarea"
                 />
               </div>
 
+              {/* Activity */}
+              <div>
+                <h3 className="text-sm text-gray-400 mb-2 flex items-center gap-2">
+                  <History className="w-4 h-4" />
+                  Activity
+                </h3>
+                <div className="space-y-2" data-testid="job-activity">
+                  {events.length === 0 && !loadingEvents && (
+                    <p className="text-gray-500 text-sm">No activity yet</p>
+                  )}
+                  {events.map((event) => (
+                    <div key={event.id} className="bg-black/30 p-3 rounded-lg">
+                      <p className="text-white whitespace-pre-wrap">{describeEvent(event)}</p>
+                      <p className="text-xs text-gray-500 mt-1">
+                        {event.actor} · {new Date(event.ts).toLocaleString()}
+                      </p>
+                    </div>
+                  ))}
+                  {nextBefore && (
+                    <Button
+                      type="button"
+                      variant="outline"
+                      size="sm"
+                      onClick={() => fetchEvents(nextBefore)}
+                      disabled={loadingEvents}
+                      className="border-gray-700 text-white hover:bg-gray-800"
+                      data-testid="load-older-activity-button"
+                    >
+                      {loadingEvents ? 'Loading...' : 'Load older'}
+                    </Button>
+                  )}
+                </div>
+              </div>
+
               {/* Status Update (Manager only) */}
               {isManager && (
                 <div>
@@ -493,12 +579,12 @@ const JobDetailsModal = ({ job, open, onClose, onUpdate, isManager }) => {
                   Close
                 </Button>
                 <Button
-                  onClick={handleUpdateNotes}
-                  disabled={updating || notes === job.notes}
+                  onClick={handleAddNote}
+                  disabled={updating || !note.trim()}
                   className="flex-1 bg-red-600 hover:bg-red-700 text-white"
                   data-testid="save-notes-button"
                 >
-                  {updating ? 'Saving...' : 'Save Notes'}
+                  {updating ? 'Saving...' : 'Add Note'}
                 </Button>
               </div>
             </>
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import axios from 'axios';
 import { toast } from 'sonner';
 import { Button } from '../components/ui/button';
@@ -8,22 +8,46 @@ import JobDetailsModal from '../components/JobDetailsModal';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+const QUEUE_PAGE_SIZE = 20;
+// Largest page the queue endpoint serves; the poll refreshes up to this many loaded entries in one request
+const QUEUE_REFRESH_LIMIT = 100;
+const COMPLETED_PAGE_SIZE = 10;
+
+// Later pages can overlap earlier ones once the queue shifts; keep the first copy
+const mergeQueueItems = (items, more) => {
+  const seen = new Set(items.map((item) => item.job_id));
+  return [...items, ...more.filter((item) => !seen.has(item.job_id))];
+};
+
 const MechanicDashboard = ({ user, onLogout }) => {
-  const [jobs, setJobs] = useState([]);
+  const [queue, setQueue] = useState({ items: [], total: 0, overdue_count: 0 });
+  // Read by the poll without restarting its interval
+  const queuePages = useRef(1);
+  const [completed, setCompleted] = useState({ items: [], total: 0, page: 1 });
   const [stats, setStats] = useState({ active: 0, completed: 0, total: 0 });
   const [loading, setLoading] = useState(true);
   const [selectedJob, setSelectedJob] = useState(null);
   const [showJobDetails, setShowJobDetails] = useState(false);
 
-  const fetchJobs = async () => {
+  const fetchJobs = useCallback(async () => {
     try {
       const token = localStorage.getItem('token');
-      const [jobsResponse, statsResponse] = await Promise.all([
-        axios.get(`${API}/jobs`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${API}/stats`, { headers: { Authorization: `Bearer ${token}` } }),
+      const headers = { Authorization: `Bearer ${token}` };
+      // Refresh everything "Load more" has shown in one request
+      const refreshSize = Math.min(queuePages.current * QUEUE_PAGE_SIZE, QUEUE_REFRESH_LIMIT);
+      const [queueResponse, statsResponse] = await Promise.all([
+        axios.get(`${API}/mechanics/${user.username}/queue`, {
+          headers,
+          params: { page: 1, page_size: refreshSize },
+        }),
+        axios.get(`${API}/stats`, { headers }),
       ]);
       
-      setJobs(jobsResponse.data);
+      setQueue((current) => ({
+        ...queueResponse.data,
+        // Entries loaded past the refresh limit are kept as they were
+        items: mergeQueueItems(queueResponse.data.items, current.items.slice(refreshSize)),
+      }));
       setStats(statsResponse.data);
     } catch (error) {
       console.error('Error fetching jobs:', error);
@@ -31,6 +55,42 @@ const MechanicDashboard = ({ user, onLogout }) => {
     } finally {
       setLoading(false);
     }
+  }, [user.username]);
+
+  const fetchCompleted = useCallback(async (page = 1) => {
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.get(`${API}/mechanics/${user.username}/completed`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { page, page_size: COMPLETED_PAGE_SIZE },
+      });
+      setCompleted((current) => ({
+        items: page === 1 ? response.data.items : [...current.items, ...response.data.items],
+        total: response.data.total,
+        page,
+      }));
+    } catch (error) {
+      console.error('Error fetching completed jobs:', error);
+      toast.error('Failed to load completed jobs');
+    }
+  }, [user.username]);
+
+  const loadMoreQueue = async () => {
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.get(`${API}/mechanics/${user.username}/queue`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { page: queuePages.current + 1, page_size: QUEUE_PAGE_SIZE },
+      });
+      queuePages.current += 1;
+      setQueue((current) => ({
+        ...response.data,
+        items: mergeQueueItems(current.items, response.data.items),
+      }));
+    } catch (error) {
+      console.error('Error fetching queue:', error);
+      toast.error('Failed to load more jobs');
+    }
   };
 
   useEffect(() => {
@@ -38,7 +98,26 @@ const MechanicDashboard = ({ user, onLogout }) => {
     // Refresh every 30 seconds
     const interval = setInterval(fetchJobs, 30000);
     return () => clearInterval(interval);
-  }, []);
+  }, [fetchJobs]);
+
+  // Completed jobs don't change on their own, load them once and after marking a job done
+  useEffect(() => {
+    fetchCompleted();
+  }, [fetchCompleted]);
+
+  const openJob = async (jobId) => {
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.get(`${API}/jobs/${jobId}`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      setSelectedJob(response.data);
+      setShowJobDetails(true);
+    } catch (error) {
+      console.error('Error fetching job:', error);
+      toast.error('Failed to load job details');
+    }
+  };
 
   const handleStartJob = async (jobId) => {
     try {
@@ -66,6 +145,7 @@ const MechanicDashboard = ({ user, onLogout }) => {
       );
       toast.success('Job marked as done!');
       fetchJobs();
+      fetchCompleted();
     } catch (error) {
       console.error('Error marking job done:', error);
       toast.error('Failed to mark job done');
@@ -87,8 +167,7 @@ const MechanicDashboard = ({ user, onLogout }) => {
     }
   };
 
-  const activeJobs = jobs.filter((j) => j.status === 'Pending' || j.status === 'In Progress');
-  const completedJobs = jobs.filter((j) => j.status === 'Done' || j.status === 'Delivered');
+  const activeJobs = queue.items;
 
   if (loading) {
     return (
@@ -152,7 +231,14 @@ const MechanicDashboard = ({ user, onLogout }) => {
 
       {/* Active Jobs */}
       <div className="mb-6">
-        <h2 className="text-xl md:text-2xl font-bold text-red-600 mb-4">Active Jobs</h2>
+        <h2 className="text-xl md:text-2xl font-bold text-red-600 mb-4">
+          Active Jobs
+          {queue.overdue_count > 0 && (
+            <span className="ml-3 text-sm font-semibold text-orange-500" data-testid="overdue-count">
+              {queue.overdue_count} overdue
+            </span>
+          )}
+        </h2>
         {activeJobs.length === 0 ? (
           <div className="glass rounded-xl p-8 text-center" data-testid="no-active-jobs">
             <CheckCircle className="w-16 h-16 text-green-500 mx-auto mb-4" />
@@ -163,13 +249,10 @@ const MechanicDashboard = ({ user, onLogout }) => {
           <div className="space-y-4">
             {activeJobs.map((job) => (
               <div
-                key={job.id}
-                className="glass rounded-xl p-4 md:p-6 card-hover border-l-4 border-red-600 cursor-pointer"
-                onClick={() => {
-                  setSelectedJob(job);
-                  setShowJobDetails(true);
-                }}
-                data-testid={`active-job-card-${job.id}`}
+                key={job.job_id}
+                className={`glass rounded-xl p-4 md:p-6 card-hover border-l-4 cursor-pointer ${job.overdue ? 'border-orange-500' : 'border-red-600'}`}
+                onClick={() => openJob(job.job_id)}
+                data-testid={`active-job-card-${job.job_id}`}
               >
                 <div className="flex flex-col md:flex-row md:items-center md:justify-between gap-4">
                   <div className="flex-1">
@@ -193,8 +276,9 @@ const MechanicDashboard = ({ user, onLogout }) => {
                       </div>
                       <div className="md:col-span-2">
                         <span className="text-gray-500">Delivery: </span>
-                        <span className="text-white font-medium">
+                        <span className={`font-medium ${job.overdue ? 'text-orange-500' : 'text-white'}`}>
                           {new Date(job.estimated_delivery).toLocaleDateString()}
+                          {job.overdue && ' (overdue)'}
                         </span>
                       </div>
                     </div>
@@ -206,31 +290,28 @@ const MechanicDashboard = ({ user, onLogout }) => {
                   <div className="flex md:flex-col gap-2" onClick={(e) => e.stopPropagation()}>
                     {job.status === 'Pending' && (
                       <Button
-                        onClick={() => handleStartJob(job.id)}
+                        onClick={() => handleStartJob(job.job_id)}
                         className="flex-1 md:flex-none bg-orange-600 hover:bg-orange-700 text-white font-semibold"
-                        data-testid={`start-job-button-${job.id}`}
+                        data-testid={`start-job-button-${job.job_id}`}
                       >
                         Start Job
                       </Button>
                     )}
                     {job.status === 'In Progress' && (
                       <Button
-                        onClick={() => handleMarkDone(job.id)}
+                        onClick={() => handleMarkDone(job.job_id)}
                         className="flex-1 md:flex-none bg-green-600 hover:bg-green-700 text-white font-semibold"
-                        data-testid={`mark-done-button-${job.id}`}
+                        data-testid={`mark-done-button-${job.job_id}`}
                       >
                         <CheckCircle className="w-4 h-4 mr-2" />
                         Mark as Done
                       </Button>
                     )}
                     <Button
-                      onClick={() => {
-                        setSelectedJob(job);
-                        setShowJobDetails(true);
-                      }}
+                      onClick={() => openJob(job.job_id)}
                       variant="outline"
                       className="flex-1 md:flex-none border-gray-700 text-white hover:bg-gray-800"
-                      data-testid={`add-notes-button-${job.id}`}
+                      data-testid={`add-notes-button-${job.job_id}`}
                     >
                       Add Notes
                     </Button>
@@ -238,6 +319,16 @@ const MechanicDashboard = ({ user, onLogout }) => {
                 </div>
               </div>
             ))}
+            {activeJobs.length < queue.total && (
+              <Button
+                onClick={loadMoreQueue}
+                variant="outline"
+                className="w-full border-gray-700 text-white hover:bg-gray-800"
+                data-testid="load-more-queue-button"
+              >
+                Load more ({queue.total - activeJobs.length} remaining)
+              </Button>
+            )}
           </div>
         )}
       </div>
@@ -245,20 +336,17 @@ const MechanicDashboard = ({ user, onLogout }) => {
       {/* Completed Jobs */}
       <div>
         <h2 className="text-xl md:text-2xl font-bold text-green-600 mb-4">Completed Jobs</h2>
-        {completedJobs.length === 0 ? (
+        {completed.items.length === 0 ? (
           <div className="glass rounded-xl p-6 text-center">
             <p className="text-gray-500">No completed jobs yet</p>
           </div>
         ) : (
           <div className="space-y-4">
-            {completedJobs.map((job) => (
+            {completed.items.map((job) => (
               <div
                 key={job.id}
                 className="glass rounded-xl p-4 md:p-6 border-l-4 border-green-600 cursor-pointer hover:bg-black/30 transition-colors"
-                onClick={() => {
-                  setSelectedJob(job);
-                  setShowJobDetails(true);
-                }}
+                onClick={() => openJob(job.id)}
                 data-testid={`completed-job-card-${job.id}`}
               >
                 <div className="flex items-center justify-between">
@@ -289,6 +377,16 @@ const MechanicDashboard = ({ user, onLogout }) => {
                 </div>
               </div>
             ))}
+            {completed.items.length < completed.total && (
+              <Button
+                onClick={() => fetchCompleted(completed.page + 1)}
+                variant="outline"
+                className="w-full border-gray-700 text-white hover:bg-gray-800"
+                data-testid="load-more-completed-button"
+              >
+                Load more ({completed.total - completed.items.length} remaining)
+              </Button>
+            )}
           </div>
         )}
       </div>
@@ -302,7 +400,10 @@ const MechanicDashboard = ({ user, onLogout }) => {
             setShowJobDetails(false);
             setSelectedJob(null);
           }}
-          onUpdate={fetchJobs}
+          onUpdate={() => {
+            fetchJobs();
+            fetchCompleted();
+          }}
           isManager={false}
         />
       )}
@@ -0,0 +1,40 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# server.py lives in backend/ and reads its configuration at import time
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "icd_tuning_test")
+
+# Imported after the path and environment are set up
+import server
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(server.time, "monotonic", fake)
+    return fake
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    """In-memory MongoDB for endpoint tests, with the cache and limiter kept in process"""
+    from mongomock_motor import AsyncMongoMockClient
+    
+    database = AsyncMongoMockClient()["icd_tuning_test"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "cache", server.ReadThroughCache(server.InMemoryCacheBackend(), 32))
+    monkeypatch.setattr(server, "rate_limiter", server.InMemoryRateLimitBackend())
+    return database
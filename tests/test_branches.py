@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def make_user(username, role, branch):
+    return server.User(id=username, username=username, role=role, full_name=username.title(), branch=branch)
+
+
+HEAD_MANAGER = make_user("ravi", "Manager", "chennai")
+PUNE_MANAGER = make_user("anil", "Manager", "pune")
+
+
+def make_job(job_id, mechanic, branch, status="Pending"):
+    return {
+        "id": job_id,
+        "customer_name": f"Customer {job_id}",
+        "contact_number": "+91 90000 00000",
+        "car_brand": "VW",
+        "car_model": "Polo GT",
+        "year": 2019,
+        "registration_number": f"REG-{job_id}",
+        "entry_date": "2026-10-01",
+        "assigned_mechanic": mechanic,
+        "work_description": "Stage 1",
+        "estimated_delivery": "2026-12-01",
+        "status": status,
+        "branch": branch,
+    }
+
+
+@pytest.fixture
+def two_branches(mock_db):
+    async def setup():
+        await mock_db.users.insert_many([
+            {**make_user("suresh", "Mechanic", "chennai").model_dump(), "password_hash": "x"},
+            {**make_user("vikram", "Mechanic", "pune").model_dump(), "password_hash": "x"},
+        ])
+        for job in (make_job("job-chennai", "suresh", "chennai"), make_job("job-pune", "vikram", "pune")):
+            await mock_db.jobs.insert_one(dict(job))
+            await server.sync_mechanic_queue(job)
+    
+    asyncio.run(setup())
+    return mock_db
+
+
+def assert_status(call, status_code):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(call)
+    assert error.value.status_code == status_code
+
+
+def test_job_of_another_branch_is_not_found(two_branches):
+    assert_status(server.get_job("job-pune", current_user=HEAD_MANAGER), 404)
+    assert_status(server.update_job("job-pune", server.JobUpdate(status="Done"), current_user=HEAD_MANAGER), 404)
+    assert asyncio.run(server.get_job("job-pune", current_user=PUNE_MANAGER)).id == "job-pune"
+
+
+def test_job_lists_and_mechanics_are_branch_scoped(two_branches):
+    jobs = asyncio.run(server.get_jobs(current_user=HEAD_MANAGER))
+    assert [job.id for job in jobs] == ["job-chennai"]
+    mechanics = asyncio.run(server.get_mechanics(current_user=PUNE_MANAGER))
+    assert [mechanic.username for mechanic in mechanics] == ["vikram"]
+
+
+def test_queue_of_another_branch_mechanic_is_not_found(two_branches):
+    assert_status(server.get_mechanic_queue("vikram", current_user=HEAD_MANAGER), 404)
+    assert_status(server.get_completed_jobs("vikram", current_user=HEAD_MANAGER), 404)
+    queue = asyncio.run(server.get_mechanic_queue("vikram", current_user=PUNE_MANAGER))
+    assert [entry.job_id for entry in queue.items] == ["job-pune"]
+
+
+def test_export_only_contains_own_branch(two_branches):
+    async def export():
+        query = server.build_export_query(HEAD_MANAGER, None, None, None, None)
+        return b"".join([chunk async for chunk in server.stream_jobs_csv(query)]).decode("utf-8")
+    
+    csv_text = asyncio.run(export())
+    assert "REG-job-chennai" in csv_text
+    assert "REG-job-pune" not in csv_text
+
+
+def test_jobs_cannot_be_assigned_across_branches(two_branches):
+    job = server.JobCreate(**{k: v for k, v in make_job("new", "vikram", "chennai").items() if k not in ("id", "branch")})
+    assert_status(server.create_job(job, current_user=HEAD_MANAGER), 400)
+    assert_status(server.update_job("job-chennai", server.JobUpdate(assigned_mechanic="vikram"), current_user=HEAD_MANAGER), 400)
+
+
+def test_head_office_opens_a_branch_with_its_manager(two_branches):
+    request = server.BranchCreate(
+        branch="Bangalore",
+        profile=server.BranchProfile(name="ICD Tuning Bangalore", invoice_prefix="ICB"),
+        manager=server.UserCreate(username="kiran", password="secret", role="Mechanic", full_name="Kiran"),
+    )
+    created = asyncio.run(server.create_branch(request, current_user=HEAD_MANAGER))
+    assert created.branch == "bangalore"
+    assert (created.manager.role, created.manager.branch) == ("Manager", "bangalore")
+    
+    # The new manager registers staff into their own branch only
+    staff = server.UserCreate(username="arjun", password="secret", role="Mechanic", full_name="Arjun")
+    mechanic = asyncio.run(server.register(staff, current_user=created.manager))
+    assert mechanic.branch == "bangalore"
+    assert asyncio.run(server.get_branch_profile("bangalore")).invoice_prefix == "ICB"
+    
+    assert_status(server.create_branch(request, current_user=HEAD_MANAGER), 400)
+
+
+def test_only_head_office_managers_open_branches(two_branches):
+    with pytest.raises(HTTPException) as error:
+        server.require_head_office(PUNE_MANAGER)
+    assert error.value.status_code == 403
@@ -0,0 +1,151 @@
+import asyncio
+
+import server
+
+
+def make_cache(backend=None, max_entries=8, max_bytes=server.CACHE_MAX_BYTES):
+    return server.ReadThroughCache(backend or server.InMemoryCacheBackend(), max_entries, max_bytes)
+
+
+class CountingBackend(server.InMemoryCacheBackend):
+    def __init__(self):
+        super().__init__()
+        self.version_reads = 0
+
+    async def get_version(self, key):
+        self.version_reads += 1
+        return await super().get_version(key)
+
+
+class CountingLoader:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+def test_second_read_is_a_hit(clock):
+    cache = make_cache()
+    loader = CountingLoader({"id": "job-1"})
+    assert asyncio.run(cache.get_or_load("job", "job-1", loader)) == {"id": "job-1"}
+    assert asyncio.run(cache.get_or_load("job", "job-1", loader)) == {"id": "job-1"}
+    assert loader.calls == 1
+
+
+def test_none_is_not_cached(clock):
+    cache = make_cache()
+    loader = CountingLoader(None)
+    asyncio.run(cache.get_or_load("job", "missing", loader))
+    asyncio.run(cache.get_or_load("job", "missing", loader))
+    assert loader.calls == 2
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = make_cache()
+    loader = CountingLoader({"id": "job-1"})
+    asyncio.run(cache.get_or_load("job", "job-1", loader))
+    clock.now += server.CACHE_TTLS["job"] + 1
+    asyncio.run(cache.get_or_load("job", "job-1", loader))
+    assert loader.calls == 2
+
+
+def test_lru_evicts_least_recently_used(clock):
+    cache = make_cache(max_entries=2)
+    loaders = {key: CountingLoader(key) for key in ("a", "b", "c")}
+    for key in ("a", "b"):
+        asyncio.run(cache.get_or_load("job", key, loaders[key]))
+    asyncio.run(cache.get_or_load("job", "a", loaders["a"]))  # a is now most recent
+    asyncio.run(cache.get_or_load("job", "c", loaders["c"]))  # evicts b
+    
+    asyncio.run(cache.get_or_load("job", "a", loaders["a"]))
+    asyncio.run(cache.get_or_load("job", "b", loaders["b"]))
+    assert loaders["a"].calls == 1
+    assert loaders["b"].calls == 2
+
+
+def test_invalidation_reaches_other_workers(clock):
+    shared = server.InMemoryCacheBackend()
+    worker_a, worker_b = make_cache(shared), make_cache(shared)
+    loader = CountingLoader({"status": "Pending"})
+    asyncio.run(worker_a.get_or_load("job", "job-1", loader))
+    asyncio.run(worker_b.get_or_load("job", "job-1", loader))
+    
+    asyncio.run(worker_a.invalidate("job", "job-1"))
+    loader.value = {"status": "Done"}
+    assert asyncio.run(worker_b.get_or_load("job", "job-1", loader)) == {"status": "Done"}
+
+
+def test_confirmed_hits_skip_the_version_check(clock):
+    backend = CountingBackend()
+    cache = make_cache(backend)
+    loader = CountingLoader({"id": "job-1"})
+    for _ in range(4):
+        asyncio.run(cache.get_or_load("job", "job-1", loader))
+    # Load, then one confirmation; the remaining hits are served locally
+    assert backend.version_reads == 2
+    
+    clock.now += server.CACHE_VERSION_CHECK_SECONDS
+    asyncio.run(cache.get_or_load("job", "job-1", loader))
+    assert backend.version_reads == 3
+    assert loader.calls == 1
+
+
+def test_other_workers_see_invalidation_within_check_window(clock):
+    shared = server.InMemoryCacheBackend()
+    worker_a, worker_b = make_cache(shared), make_cache(shared)
+    loader = CountingLoader({"status": "Pending"})
+    asyncio.run(worker_b.get_or_load("job", "job-1", loader))
+    asyncio.run(worker_b.get_or_load("job", "job-1", loader))  # confirmed
+    
+    asyncio.run(worker_a.invalidate("job", "job-1"))
+    loader.value = {"status": "Done"}
+    clock.now += server.CACHE_VERSION_CHECK_SECONDS
+    assert asyncio.run(worker_b.get_or_load("job", "job-1", loader)) == {"status": "Done"}
+
+
+def test_lru_is_bounded_by_size(clock):
+    photo = "x" * 1000
+    cache = make_cache(max_bytes=2500)
+    loaders = {key: CountingLoader({"photos": [photo]}) for key in ("a", "b", "c")}
+    for key in ("a", "b", "c"):
+        asyncio.run(cache.get_or_load("job", key, loaders[key]))
+    assert cache.local.total_bytes <= 2500
+    assert list(cache.local.entries) == ["job:b", "job:c"]
+
+
+def test_values_larger_than_the_cache_are_not_stored(clock):
+    cache = make_cache(max_bytes=500)
+    loader = CountingLoader({"photos": ["x" * 1000]})
+    asyncio.run(cache.get_or_load("job", "big", loader))
+    asyncio.run(cache.get_or_load("job", "big", loader))
+    assert loader.calls == 2
+    assert cache.local.total_bytes == 0
+
+
+def test_invalidation_during_load_is_not_lost(clock):
+    cache = make_cache()
+    
+    async def racing_loader():
+        # A write lands after the read started but before the value is stored
+        await cache.invalidate("job", "job-1")
+        return {"status": "Pending"}
+    
+    asyncio.run(cache.get_or_load("job", "job-1", racing_loader))
+    fresh = CountingLoader({"status": "Done"})
+    assert asyncio.run(cache.get_or_load("job", "job-1", fresh)) == {"status": "Done"}
+
+
+def test_stats_are_shared_across_workers(clock):
+    shared = server.InMemoryCacheBackend()
+    worker_a, worker_b = make_cache(shared), make_cache(shared)
+    loader = CountingLoader(["mechanic"])
+    asyncio.run(worker_a.get_or_load("mechanics", "chennai", loader))
+    asyncio.run(worker_a.get_or_load("mechanics", "chennai", loader))
+    asyncio.run(worker_a.flush_stats())
+    asyncio.run(worker_b.get_or_load("mechanics", "chennai", loader))
+    
+    stats = asyncio.run(worker_b.get_stats())
+    assert stats["mechanics"] == {"hits": 1, "misses": 2, "hit_rate": 0.3333}
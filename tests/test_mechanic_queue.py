@@ -0,0 +1,123 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+
+MANAGER = server.User(id="ravi", username="ravi", role="Manager", full_name="Ravi", branch="chennai")
+
+
+def job_snapshot(version, status="Pending", mechanic="suresh", job_id="job-1", **fields):
+    return {
+        "id": job_id,
+        "customer_name": "Arun",
+        "contact_number": "+91 90000 00000",
+        "car_brand": "VW",
+        "car_model": "Polo GT",
+        "year": 2019,
+        "registration_number": f"REG-{job_id}",
+        "entry_date": "2026-10-01",
+        "assigned_mechanic": mechanic,
+        "work_description": "Stage 1",
+        "estimated_delivery": "2999-01-01",
+        "status": status,
+        "branch": "chennai",
+        "version": version,
+        **fields,
+    }
+
+
+@pytest.fixture
+def queue_db(mock_db):
+    async def setup():
+        await mock_db.mechanic_queue.create_index("job_id", unique=True)
+        for username in ("suresh", "karthik"):
+            await mock_db.users.insert_one({"username": username, "role": "Mechanic", "branch": "chennai"})
+    
+    asyncio.run(setup())
+    return mock_db
+
+
+def queue_entry(db, job_id="job-1"):
+    return asyncio.run(db.mechanic_queue.find_one({"job_id": job_id}, {"_id": 0}))
+
+
+def test_older_snapshot_written_last_is_ignored(queue_db):
+    asyncio.run(server.sync_mechanic_queue(job_snapshot(2, status="In Progress")))
+    asyncio.run(server.sync_mechanic_queue(job_snapshot(1, status="Pending")))
+    entry = queue_entry(queue_db)
+    assert (entry["version"], entry["status"]) == (2, "In Progress")
+
+
+def test_older_snapshot_cannot_re_add_a_finished_job(queue_db):
+    asyncio.run(server.sync_mechanic_queue(job_snapshot(1)))
+    asyncio.run(server.sync_mechanic_queue(job_snapshot(3, status="Done")))
+    asyncio.run(server.sync_mechanic_queue(job_snapshot(2, status="In Progress")))
+    
+    queue = asyncio.run(server.get_mechanic_queue("suresh", current_user=MANAGER))
+    assert queue.total == 0
+    assert "mechanic" not in queue_entry(queue_db)
+
+
+def test_reassignment_moves_the_entry(queue_db):
+    asyncio.run(server.sync_mechanic_queue(job_snapshot(1, mechanic="suresh")))
+    asyncio.run(server.sync_mechanic_queue(job_snapshot(2, mechanic="karthik")))
+    asyncio.run(server.sync_mechanic_queue(job_snapshot(1, mechanic="suresh")))
+    
+    assert asyncio.run(server.get_mechanic_queue("suresh", current_user=MANAGER)).total == 0
+    karthik = asyncio.run(server.get_mechanic_queue("karthik", current_user=MANAGER))
+    assert [entry.job_id for entry in karthik.items] == ["job-1"]
+
+
+def test_update_syncs_from_the_written_document(queue_db):
+    job = server.Job(**{k: v for k, v in job_snapshot(0).items() if k != "version"})
+    asyncio.run(queue_db.jobs.insert_one(job.model_dump()))
+    asyncio.run(server.sync_mechanic_queue(job.model_dump()))
+    
+    updated = asyncio.run(server.update_job("job-1", server.JobUpdate(assigned_mechanic="karthik"), current_user=MANAGER))
+    assert updated.version == 1
+    entry = queue_entry(queue_db)
+    assert (entry["version"], entry["mechanic"]) == (1, "karthik")
+
+
+def test_late_update_after_delete_leaves_no_entry(queue_db):
+    job = server.Job(**{k: v for k, v in job_snapshot(0).items() if k != "version"})
+    asyncio.run(queue_db.jobs.insert_one(job.model_dump()))
+    asyncio.run(server.sync_mechanic_queue(job.model_dump()))
+    
+    asyncio.run(server.delete_job("job-1", current_user=MANAGER))
+    # An update that read the job before the delete syncs afterwards
+    asyncio.run(server.sync_mechanic_queue(job_snapshot(0, status="In Progress")))
+    
+    assert asyncio.run(server.get_mechanic_queue("suresh", current_user=MANAGER)).total == 0
+    assert queue_entry(queue_db)["removed_at"] is not None
+
+
+def test_page_spans_the_overdue_boundary(queue_db):
+    today = datetime.now(server.WORKSHOP_TIMEZONE).date()
+    for index in range(3):
+        due = (today - timedelta(days=3 - index)).isoformat()
+        asyncio.run(server.sync_mechanic_queue(job_snapshot(0, job_id=f"late-{index}", estimated_delivery=due)))
+    for index in range(3):
+        asyncio.run(server.sync_mechanic_queue(
+            job_snapshot(0, job_id=f"next-{index}", entry_date=f"2026-10-0{index + 1}", estimated_delivery="2999-01-01")
+        ))
+    
+    page_2 = asyncio.run(server.get_mechanic_queue("suresh", page=2, page_size=2, current_user=MANAGER))
+    assert (page_2.total, page_2.overdue_count) == (6, 3)
+    assert [(entry.job_id, entry.overdue) for entry in page_2.items] == [("late-2", True), ("next-0", False)]
+    
+    page_3 = asyncio.run(server.get_mechanic_queue("suresh", page=3, page_size=2, current_user=MANAGER))
+    assert [entry.job_id for entry in page_3.items] == ["next-1", "next-2"]
+
+
+def test_stats_count_by_status(queue_db):
+    async def setup():
+        for index, status in enumerate(["Pending", "In Progress", "Done", "Delivered", "Done"]):
+            await queue_db.jobs.insert_one(job_snapshot(0, job_id=f"job-{index}", status=status))
+    
+    asyncio.run(setup())
+    mechanic = server.User(id="suresh", username="suresh", role="Mechanic", full_name="Suresh", branch="chennai")
+    assert asyncio.run(server.get_stats(current_user=mechanic)) == {"active": 2, "completed": 3, "total": 5}
@@ -0,0 +1,206 @@
+import asyncio
+import os
+import time
+
+import pytest
+from starlette.requests import Request
+from fastapi import HTTPException
+
+import server
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    backend = server.InMemoryRateLimitBackend()
+    monkeypatch.setattr(server, "rate_limiter", backend)
+    return backend
+
+
+def make_request(client_ip="10.0.0.1", forwarded_for=None):
+    headers = []
+    if forwarded_for:
+        headers.append((b"x-forwarded-for", forwarded_for.encode()))
+    return Request({"type": "http", "headers": headers, "client": (client_ip, 5000)})
+
+
+def test_bucket_allows_capacity_then_rejects(limiter, clock):
+    results = [asyncio.run(limiter.take_token("k", 3, 1)) for _ in range(4)]
+    assert results[:3] == [0, 0, 0]
+    assert results[3] == pytest.approx(1)
+
+
+def test_bucket_refills_over_time(limiter, clock):
+    for _ in range(3):
+        asyncio.run(limiter.take_token("k", 3, 1))
+    assert asyncio.run(limiter.take_token("k", 3, 1)) > 0
+    
+    clock.now += 1
+    assert asyncio.run(limiter.take_token("k", 3, 1)) == 0
+    assert asyncio.run(limiter.take_token("k", 3, 1)) > 0
+
+
+def test_bucket_never_exceeds_capacity(limiter, clock):
+    asyncio.run(limiter.take_token("k", 2, 1))
+    clock.now += 3600
+    results = [asyncio.run(limiter.take_token("k", 2, 1)) for _ in range(3)]
+    assert results[:2] == [0, 0]
+    assert results[2] > 0
+
+
+def test_check_only_does_not_consume(limiter, clock):
+    for _ in range(5):
+        assert asyncio.run(limiter.take_token("k", 1, 1, cost=0)) == 0
+    assert asyncio.run(limiter.take_token("k", 1, 1)) == 0
+    assert asyncio.run(limiter.take_token("k", 1, 1, cost=0)) > 0
+
+
+def test_full_buckets_are_pruned(limiter, clock, monkeypatch):
+    monkeypatch.setattr(server.InMemoryRateLimitBackend, "MAX_BUCKETS", 2)
+    for key in ("a", "b", "c"):
+        asyncio.run(limiter.take_token(key, 1, 1))
+    clock.now += 10
+    asyncio.run(limiter.take_token("d", 1, 1))
+    assert set(limiter.buckets) == {"d"}
+
+
+def test_slots_limit_and_release(limiter, clock):
+    first = asyncio.run(limiter.acquire_slot("export", 2, 60))
+    second = asyncio.run(limiter.acquire_slot("export", 2, 60))
+    assert first and second and first != second
+    assert asyncio.run(limiter.acquire_slot("export", 2, 60)) is None
+    
+    asyncio.run(limiter.release_slot("export", first))
+    assert asyncio.run(limiter.acquire_slot("export", 2, 60)) is not None
+
+
+def test_expired_lease_is_reclaimed(limiter, clock):
+    assert asyncio.run(limiter.acquire_slot("export", 1, 60)) is not None
+    assert asyncio.run(limiter.acquire_slot("export", 1, 60)) is None
+    clock.now += 61
+    assert asyncio.run(limiter.acquire_slot("export", 1, 60)) is not None
+
+
+def test_concurrency_limit_raises_503_and_releases(limiter, clock):
+    limit, _ = server.CONCURRENCY_LIMITS["export"]
+    
+    async def scenario():
+        async with server.concurrency_limit("export"):
+            with pytest.raises(HTTPException) as excinfo:
+                async with server.concurrency_limit("export"):
+                    pass
+            assert excinfo.value.status_code == 503
+            assert "Retry-After" in excinfo.value.headers
+        # Released on exit
+        async with server.concurrency_limit("export"):
+            pass
+    
+    assert limit == 1
+    asyncio.run(scenario())
+
+
+def test_streamed_export_holds_slot_until_finished(limiter, clock):
+    async def rows():
+        yield b"a"
+        # Still streaming, so the only export slot is taken
+        assert await limiter.acquire_slot("export", 1, 60) is None
+        yield b"b"
+    
+    async def scenario():
+        token = await server.acquire_concurrency_slot("export")
+        with pytest.raises(HTTPException) as excinfo:
+            await server.acquire_concurrency_slot("export")
+        assert excinfo.value.status_code == 503
+        
+        chunks = [chunk async for chunk in server.release_slot_after(rows(), "export", token)]
+        assert chunks == [b"a", b"b"]
+        assert await limiter.acquire_slot("export", 1, 60) is not None
+    
+    asyncio.run(scenario())
+
+
+def test_long_stream_renews_its_lease(limiter, clock):
+    async def rows():
+        for _ in range(3):
+            clock.now += server.CONCURRENCY_LEASE_SECONDS * 0.6
+            yield b"row"
+            # Without renewal the lease would have expired by the last row
+            assert await limiter.acquire_slot("export", 1, 60) is None
+    
+    async def scenario():
+        token = await server.acquire_concurrency_slot("export")
+        [chunk async for chunk in server.release_slot_after(rows(), "export", token)]
+    
+    asyncio.run(scenario())
+
+
+def test_enforce_rate_limit_returns_429_with_retry_after(limiter, clock):
+    capacity, _ = server.RATE_LIMITS["invoice"]
+    request = make_request()
+    for _ in range(capacity):
+        asyncio.run(server.enforce_rate_limit(request, "invoice", "admin"))
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(server.enforce_rate_limit(request, "invoice", "admin"))
+    assert excinfo.value.status_code == 429
+    assert int(excinfo.value.headers["Retry-After"]) >= 1
+
+
+def test_login_failures_lock_only_the_offending_ip(limiter, clock):
+    capacity, _ = server.RATE_LIMITS["login_failures"]
+    attacker = make_request(forwarded_for="203.0.113.9")
+    owner = make_request(forwarded_for="198.51.100.7")
+    
+    for _ in range(capacity):
+        asyncio.run(server.enforce_login_failure_limit(attacker, "admin"))
+        asyncio.run(server.enforce_login_failure_limit(attacker, "admin", failed=True))
+    
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(server.enforce_login_failure_limit(attacker, "admin"))
+    assert excinfo.value.status_code == 429
+    # The account owner on another IP can still log in
+    asyncio.run(server.enforce_login_failure_limit(owner, "admin"))
+
+
+def test_successful_logins_are_not_charged(limiter, clock):
+    capacity, _ = server.RATE_LIMITS["login_failures"]
+    request = make_request()
+    for _ in range(capacity * 3):
+        asyncio.run(server.enforce_login_failure_limit(request, "admin"))
+
+
+def test_client_ip_ignores_forged_forwarded_entries(monkeypatch):
+    monkeypatch.setattr(server, "TRUSTED_PROXY_HOPS", 1)
+    request = make_request(client_ip="10.0.0.2", forwarded_for="1.2.3.4, 203.0.113.9")
+    assert server.get_client_ip(request) == "203.0.113.9"
+    assert server.get_client_ip(make_request(client_ip="10.0.0.2")) == "10.0.0.2"
+    
+    monkeypatch.setattr(server, "TRUSTED_PROXY_HOPS", 0)
+    assert server.get_client_ip(request) == "10.0.0.2"
+
+
+@pytest.mark.skipif(not os.environ.get("MONGO_TEST_URL"), reason="MONGO_TEST_URL not set")
+def test_mongo_backend_buckets_and_slots():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    
+    async def scenario():
+        mongo = AsyncIOMotorClient(os.environ["MONGO_TEST_URL"])
+        database = mongo[f"rate_limit_test_{int(time.time() * 1000)}"]
+        try:
+            backend = server.MongoRateLimitBackend(database)
+            await backend.setup()
+            
+            assert [await backend.take_token("k", 2, 0.01) for _ in range(2)] == [0, 0]
+            assert await backend.take_token("k", 2, 0.01) > 0
+            assert await backend.take_token("k", 2, 0.01, cost=0) > 0
+            
+            first = await backend.acquire_slot("export", 1, 60)
+            assert first is not None
+            assert await backend.acquire_slot("export", 1, 60) is None
+            await backend.renew_slot("export", first, 120)
+            assert await backend.acquire_slot("export", 1, 60) is None
+            await backend.release_slot("export", first)
+            assert await backend.acquire_slot("export", 1, 60) is not None
+        finally:
+            await mongo.drop_database(database.name)
+            mongo.close()
+    
+    asyncio.run(scenario())